@@ -16,45 +16,71 @@
 Inputs all SVG files "foo.svg" under the root recursively, and outputs
 each file as "foo.bakedsvg.svg".
 
+Baked images are cached under a hash of their source and the versions of
+Inkscape and svgo, so that they are only baked once, even in a fresh clone.
+
 Usage:
-  mut-images [<root>]
+  mut-images [<root>] [--cache-dir=<path> | --no-cache]
+             [--metrics-file=<path>] [--profile=<path>]
   mut-images --version
 
--h --help           show this
---version           show mut version
+-h --help               show this
+--cache-dir=<path>      cache baked images in <path>. Defaults to
+                        $MUT_IMAGES_CACHE_DIR, or ~/.cache/mut/images
+--no-cache              bake every out of date image
+--metrics-file=<path>   write timings and counters for the run to <path> as json
+--profile=<path>        run under cProfile, writing the statistics to <path>
+--version               show mut version
 """
 
 import concurrent.futures
+import hashlib
 import logging
 import multiprocessing
 import os
+import shutil
 import subprocess
 import tempfile
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 import docopt
 
 from . import __version__
+from . import metrics
 from . import util
 
 logger = logging.getLogger(__name__)
 
+# The most images baked by one Inkscape session and minified by one svgo run
+MAX_BATCH_SIZE = 50
 
-def generate_svg(input_path: str, output_path: str) -> None:
-    """Clean up and minify a SVG file."""
-    logger.info("Generating %s", output_path)
-    inkscape = None
+# Characters which can't be passed to an action in Inkscape's shell
+UNSAFE_SHELL_CHARS = frozenset(";\n\r")
+
+# (input path, output path)
+Job = Tuple[str, str]
+
+CACHE_DIR_ENV = "MUT_IMAGES_CACHE_DIR"
+# Part of every cache key. Change it when the way images are baked changes.
+CACHE_VERSION = "1"
+
+
+def find_inkscape() -> str:
     for path in ("/Applications/Inkscape.app/Contents/Resources/bin/inkscape",):
         if os.path.isfile(path):
-            inkscape = path
-            break
+            return path
+
+    return "inkscape"
 
-    if not inkscape:
-        inkscape = "inkscape"
+
+def generate_svg(input_path: str, output_path: str) -> None:
+    """Clean up and minify a SVG file."""
+    logger.info("Generating %s", output_path)
+    inkscape = find_inkscape()
 
     input_path = os.path.abspath(input_path)
     output_path = os.path.abspath(output_path)
-    with tempfile.NamedTemporaryFile(suffix=".svg") as tmp:
+    with tempfile.NamedTemporaryFile(suffix=".svg") as tmp, metrics.span("generate"):
         subprocess.check_call(
             [
                 inkscape,
@@ -81,6 +107,186 @@ def generate_svg(input_path: str, output_path: str) -> None:
                 output_path,
             ]
         )
+    metrics.count("images generated")
+
+
+def generate_svg_batch(jobs: List[Job]) -> Dict[str, str]:
+    """Clean up and minify many SVG files, with a single Inkscape shell
+    session baking them all into a temporary directory, and a single svgo
+    run minifying that directory. Returns an error message for each input
+    path that could not be generated."""
+    errors = {}  # type: Dict[str, str]
+    with tempfile.TemporaryDirectory() as tmp, metrics.span("generate batch"):
+        baked_dir = os.path.join(tmp, "baked")
+        minified_dir = os.path.join(tmp, "minified")
+        os.mkdir(baked_dir)
+        os.mkdir(minified_dir)
+
+        commands = []
+        for i, (input_path, output_path) in enumerate(jobs):
+            logger.info("Generating %s", output_path)
+            commands.append(
+                "file-open:{}; vacuum-defs; export-text-to-path; "
+                "export-area-drawing; export-plain-svg; export-filename:{}; "
+                "export-do; file-close\n".format(
+                    os.path.abspath(input_path), os.path.join(baked_dir, f"{i}.svg")
+                )
+            )
+        commands.append("quit\n")
+
+        metrics.count("inkscape sessions")
+        inkscape = subprocess.run(
+            [find_inkscape(), "--shell"],
+            input="".join(commands),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+
+        baked = []
+        for i, (input_path, output_path) in enumerate(jobs):
+            if os.path.isfile(os.path.join(baked_dir, f"{i}.svg")):
+                baked.append(i)
+                continue
+
+            errors[input_path] = "Inkscape failed to export {} (exit {}): {}".format(
+                input_path, inkscape.returncode, inkscape.stderr.strip()
+            )
+
+        if not baked:
+            return errors
+
+        metrics.count("svgo runs")
+        svgo = subprocess.run(
+            [
+                "svgo",
+                "-q",
+                "--multipass",
+                "-p",
+                "1",
+                "-f",
+                baked_dir,
+                "-o",
+                minified_dir,
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+
+        for i in baked:
+            input_path, output_path = jobs[i]
+            minified = os.path.join(minified_dir, f"{i}.svg")
+            if svgo.returncode != 0 or not os.path.isfile(minified):
+                errors[input_path] = "svgo failed to minify {} (exit {}): {}".format(
+                    input_path, svgo.returncode, svgo.stderr.strip()
+                )
+                continue
+
+            shutil.move(minified, output_path)
+            metrics.count("images generated")
+
+    return errors
+
+
+def tool_versions() -> str:
+    """Return the versions reported by Inkscape and svgo."""
+    versions = []
+    for command in ([find_inkscape(), "--version"], ["svgo", "--version"]):
+        versions.append(
+            subprocess.run(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                universal_newlines=True,
+                check=True,
+            ).stdout.strip()
+        )
+    return "\n".join(versions)
+
+
+class ImageCache:
+    """Baked images, stored under a hash of their source SVG and the versions
+    of the tools that baked them. The cache lives outside of any checkout, so
+    fresh clones reuse it."""
+
+    def __init__(self, root: str, versions: str) -> None:
+        self.root = root
+        self.versions = versions
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, input_path: str) -> str:
+        hasher = hashlib.sha256()
+        hasher.update("{}\n{}\n".format(CACHE_VERSION, self.versions).encode("utf-8"))
+        with open(input_path, "rb") as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".svg")
+
+    def fetch(self, key: str, output_path: str) -> bool:
+        """Copy a cached image to output_path, returning whether it was
+        cached."""
+        partial = output_path + ".tmp"
+        try:
+            shutil.copyfile(self.path(key), partial)
+        except FileNotFoundError:
+            self.misses += 1
+            metrics.count("cache misses")
+            return False
+
+        os.replace(partial, output_path)
+        self.hits += 1
+        metrics.count("cache hits")
+        return True
+
+    def store(self, key: str, output_path: str) -> None:
+        """Add a newly baked image to the cache."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, partial = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            shutil.copyfile(output_path, partial)
+            os.replace(partial, path)
+        finally:
+            try:
+                os.remove(partial)
+            except FileNotFoundError:
+                pass
+
+
+def open_cache(options: Dict[str, object]) -> Optional[ImageCache]:
+    """Return the image cache chosen by the command line options, or None if
+    caching is disabled or the tools' versions can't be determined."""
+    if options["--no-cache"]:
+        return None
+
+    root = (
+        options["--cache-dir"]
+        or os.environ.get(CACHE_DIR_ENV)
+        or os.path.join(os.path.expanduser("~"), ".cache", "mut", "images")
+    )
+    try:
+        versions = tool_versions()
+    except (OSError, subprocess.CalledProcessError) as err:
+        logger.warning("Not caching images: could not get tool versions: %s", err)
+        return None
+
+    return ImageCache(str(root), versions)
+
+
+def make_batches(jobs: List[Job], n_workers: int) -> List[List[Job]]:
+    """Split jobs into batches to share among n_workers, each no larger than
+    MAX_BATCH_SIZE."""
+    if not jobs:
+        return []
+
+    batch_size = min(MAX_BATCH_SIZE, -(-len(jobs) // n_workers))
+    return [jobs[i : i + batch_size] for i in range(0, len(jobs), batch_size)]
 
 
 def main() -> None:
@@ -92,39 +298,91 @@ def main() -> None:
     root = str(options["<root>"] or ".")
     logging.basicConfig(level=logging.INFO)
 
-    paths = []  # type: List[str]
-    if os.path.isfile(root):
-        paths.append(root)
-    else:
-        for root, dirs, files in os.walk(root):
-            for filename in files:
-                components = os.path.splitext(filename)
-                if len(components) < 2 or components[1] != ".svg":
-                    continue
-
-                if components[0].endswith(".bakedsvg"):
-                    continue
+    with metrics.instrument(
+        "mut-images", options["--metrics-file"], options["--profile"]
+    ):
+        paths = []  # type: List[str]
+        if os.path.isfile(root):
+            paths.append(root)
+        else:
+            for root, dirs, files in os.walk(root):
+                for filename in files:
+                    components = os.path.splitext(filename)
+                    if len(components) < 2 or components[1] != ".svg":
+                        continue
 
-                paths.append(os.path.join(root, filename))
+                    if components[0].endswith(".bakedsvg"):
+                        continue
 
-    logger.info("Build Images: %d", len(paths))
+                    paths.append(os.path.join(root, filename))
 
-    n_workers = multiprocessing.cpu_count()
-    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as pool:
-        futures = []
+        logger.info("Build Images: %d", len(paths))
 
+        stale = []  # type: List[Job]
         for path in paths:
             bare_path, _ = os.path.splitext(path)
             output_filename = bare_path + ".bakedsvg.svg"
             if not util.compare_mtimes(output_filename, [path]):
+                metrics.count("images up to date")
                 continue
 
-            futures.append(pool.submit(generate_svg, path, output_filename))
+            stale.append((path, output_filename))
+
+        cache = open_cache(options) if stale else None
+        keys = {}  # type: Dict[str, str]
+        jobs = []  # type: List[Job]
+        unsafe_jobs = []  # type: List[Job]
+        for path, output_filename in stale:
+            if cache is not None:
+                key = cache.key(path)
+                if cache.fetch(key, output_filename):
+                    continue
+                keys[path] = key
+
+            if UNSAFE_SHELL_CHARS.isdisjoint(os.path.abspath(path)):
+                jobs.append((path, output_filename))
+            else:
+                unsafe_jobs.append((path, output_filename))
+
+        n_workers = multiprocessing.cpu_count()
+        errors = []  # type: List[str]
+        generated = []  # type: List[Job]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as pool:
+            batches = make_batches(jobs, n_workers)
+            batch_futures = [
+                pool.submit(generate_svg_batch, batch) for batch in batches
+            ]
+            # Paths Inkscape's shell can't open are generated one at a time
+            futures = [pool.submit(generate_svg, *job) for job in unsafe_jobs]
+
+            for batch, batch_future in zip(batches, batch_futures):
+                exception = batch_future.exception()
+                if exception:
+                    errors.append(str(exception))
+                    continue
+
+                batch_errors = batch_future.result()
+                errors.extend(batch_errors.values())
+                generated.extend(job for job in batch if job[0] not in batch_errors)
+
+            for job, f in zip(unsafe_jobs, futures):
+                exception = f.exception()
+                if exception:
+                    errors.append(str(exception))
+                else:
+                    generated.append(job)
+
+        for message in errors:
+            logger.error(message)
+            metrics.count("errors")
 
-        for f in futures:
-            exception = f.exception()
-            if exception:
-                logger.error(str(exception))
+        if cache is not None:
+            for path, output_filename in generated:
+                try:
+                    cache.store(keys[path], output_filename)
+                except OSError as err:
+                    logger.warning("Could not cache %s: %s", output_filename, err)
+            logger.info("Image cache: %d hits, %d misses", cache.hits, cache.misses)
 
 
 if __name__ == "__main__":
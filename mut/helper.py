@@ -3,19 +3,44 @@ Usage: mut images [...]
        mut intersphinx [...]
        mut publish [...]
        mut index [...]
+       mut redirects [...]
 """
 
+import importlib
 import os.path
 import subprocess
 import sys
 
+# The module providing each subcommand's main(), as in the mut-<command>
+# scripts defined in pyproject.toml
+COMMANDS = {
+    "images": "mut.build_images",
+    "index": "mut.index.main",
+    "intersphinx": "mut.intersphinx",
+    "publish": "mut.stage",
+    "redirects": "mut.redirects.redirect_main",
+}
+
 
 def main() -> None:
     """Main program entry point."""
+    try:
+        command = sys.argv[1]
+    except IndexError:
+        print(__doc__.strip())
+        sys.exit(1)
+
+    # Run known subcommands in this process, rather than paying to start
+    # another interpreter
+    if command in COMMANDS:
+        sys.argv = ["mut-{}".format(command), *sys.argv[2:]]
+        importlib.import_module(COMMANDS[command]).main()
+        return
+
     us = os.path.dirname(sys.argv[0])
     try:
-        subprocess.call([os.path.join(us, "mut-{}".format(sys.argv[1])), *sys.argv[2:]])
-    except (IndexError, FileNotFoundError):
+        subprocess.call([os.path.join(us, "mut-{}".format(command)), *sys.argv[2:]])
+    except FileNotFoundError:
         print(__doc__.strip())
         sys.exit(1)
 
@@ -0,0 +1,136 @@
+"""Decode snooty page BSON into python objects, skipping the fields that never
+contribute to a manifest entry.
+
+The scanner walks a memoryview over the source buffer, so skipped fields are
+never copied or decoded; only the strings and scalars that are kept allocate."""
+
+import struct
+from typing import Any, Dict, FrozenSet, List, Optional
+
+# Page fields that mut-index reads. Everything else (e.g. the page source) is
+# skipped at the top level of a page document.
+PAGE_FIELDS = frozenset(["filename", "ast", "facets"])
+
+# AST node fields that are skipped wherever they appear.
+PRUNED_FIELDS = frozenset(["position"])
+
+_INT32 = struct.Struct("<i")
+_INT64 = struct.Struct("<q")
+_DOUBLE = struct.Struct("<d")
+
+
+class BSONScanError(Exception):
+    """The buffer does not contain well-formed BSON."""
+
+
+def _cstring_end(data: Any, pos: int) -> int:
+    end = data.find(b"\x00", pos)
+    if end < 0:
+        raise BSONScanError("Unterminated key at offset {}".format(pos))
+    return end
+
+
+def _value_end(data: Any, element_type: int, pos: int) -> int:
+    """Return the offset just past an element's value, without decoding it."""
+    if element_type in (0x02, 0x0D, 0x0E):  # string, code, symbol
+        return pos + 4 + _INT32.unpack_from(data, pos)[0]
+    if element_type in (0x03, 0x04, 0x0F):  # document, array, code with scope
+        return pos + _INT32.unpack_from(data, pos)[0]
+    if element_type == 0x05:  # binary
+        return pos + 5 + _INT32.unpack_from(data, pos)[0]
+    if element_type in (0x01, 0x09, 0x11, 0x12):  # double, datetime, timestamp, int64
+        return pos + 8
+    if element_type == 0x10:  # int32
+        return pos + 4
+    if element_type == 0x08:  # boolean
+        return pos + 1
+    if element_type in (0x06, 0x0A, 0x7F, 0xFF):  # undefined, null, max/min key
+        return pos
+    if element_type == 0x07:  # ObjectId
+        return pos + 12
+    if element_type == 0x13:  # decimal128
+        return pos + 16
+    if element_type == 0x0B:  # regex: pattern and flags cstrings
+        return _cstring_end(data, _cstring_end(data, pos) + 1) + 1
+    if element_type == 0x0C:  # DBPointer
+        return pos + 16 + _INT32.unpack_from(data, pos)[0]
+    raise BSONScanError("Unknown element type {:#x}".format(element_type))
+
+
+def _decode_other(view: memoryview, element_type: int, pos: int, end: int) -> Any:
+    """Decode a rarely-used element type by wrapping it in a one-element
+    document and handing it to pymongo."""
+    import bson
+
+    element = bytes([element_type]) + b"_\x00" + bytes(view[pos:end])
+    size = _INT32.pack(len(element) + 5)
+    return bson.decode(size + element + b"\x00")["_"]
+
+
+def _scan_document(
+    data: Any,
+    view: memoryview,
+    pos: int,
+    as_list: bool,
+    fields: Optional[FrozenSet[str]],
+) -> Any:
+    end = pos + _INT32.unpack_from(data, pos)[0] - 1
+    if data[end] != 0:
+        raise BSONScanError("Unterminated document at offset {}".format(pos))
+
+    pos += 4
+    result_list: List[Any] = []
+    result_dict: Dict[str, Any] = {}
+    while pos < end:
+        element_type = data[pos]
+        key_end = _cstring_end(data, pos + 1)
+        value_pos = key_end + 1
+
+        if not as_list:
+            key = str(view[pos + 1 : key_end], "utf-8")
+            skip = key in PRUNED_FIELDS if fields is None else key not in fields
+            if skip:
+                pos = _value_end(data, element_type, value_pos)
+                continue
+
+        if element_type == 0x02:
+            length = _INT32.unpack_from(data, value_pos)[0]
+            value: Any = str(view[value_pos + 4 : value_pos + 3 + length], "utf-8")
+            pos = value_pos + 4 + length
+        elif element_type == 0x03 or element_type == 0x04:
+            value = _scan_document(data, view, value_pos, element_type == 0x04, None)
+            pos = value_pos + _INT32.unpack_from(data, value_pos)[0]
+        elif element_type == 0x08:
+            value = data[value_pos] == 1
+            pos = value_pos + 1
+        elif element_type == 0x0A:
+            value = None
+            pos = value_pos
+        elif element_type == 0x10:
+            value = _INT32.unpack_from(data, value_pos)[0]
+            pos = value_pos + 4
+        elif element_type == 0x12:
+            value = _INT64.unpack_from(data, value_pos)[0]
+            pos = value_pos + 8
+        elif element_type == 0x01:
+            value = _DOUBLE.unpack_from(data, value_pos)[0]
+            pos = value_pos + 8
+        else:
+            pos = _value_end(data, element_type, value_pos)
+            value = _decode_other(view, element_type, value_pos, pos)
+
+        if as_list:
+            result_list.append(value)
+        else:
+            result_dict[key] = value
+
+    return result_list if as_list else result_dict
+
+
+def decode_page(data: Any, offset: int = 0) -> Dict[str, Any]:
+    """Decode the snooty page BSON document starting at offset in data, keeping
+    only PAGE_FIELDS and dropping PRUNED_FIELDS from every nested document.
+
+    data may be any buffer supporting find(), such as bytes or an mmap."""
+    with memoryview(data) as view:
+        return _scan_document(data, view, offset, False, PAGE_FIELDS)
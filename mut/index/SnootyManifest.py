@@ -1,22 +1,67 @@
-from zipfile import ZipFile, ZipInfo
-from bson import decode_all
-from jsonpath_ng.ext import parse
-from os.path import join, splitext
-from pathlib import Path
-from json import dumps
+from zipfile import BadZipFile, ZipFile, ZipInfo, ZIP_STORED
+from os.path import splitext
+from json import dumps, JSONEncoder
+from mut.index.BSONScanner import decode_page
+from mut import metrics
 
 import logging
-
-from typing import Optional, List, Tuple, TypedDict, Dict, Any
+import mmap
+from sys import intern
+import struct
+import zlib
+
+from typing import (
+    Optional,
+    List,
+    NamedTuple,
+    Tuple,
+    TypedDict,
+    Dict,
+    Any,
+    Iterable,
+    Iterator,
+)
 
 logger = logging.getLogger(__name__)
 
+# Archive directories whose pages are never indexed
+EXCLUDED_DIRECTORIES = ("/images/", "/includes/", "/sharedinclude/")
+
+# Signature, then the fixed fields we don't need, then the lengths of the
+# variable-length filename and extra fields
+LOCAL_FILE_HEADER = struct.Struct("<4s22xHH")
+
+# Limits, in bytes of UTF-8 text, on the size of a manifest entry's paragraphs,
+# code values and headings. None means unlimited.
+FieldBudgets = NamedTuple(
+    "FieldBudgets",
+    (
+        ("paragraphs", Optional[int]),
+        ("code", Optional[int]),
+        ("headings", Optional[int]),
+    ),
+)
+NO_BUDGETS = FieldBudgets(None, None, None)
+
+# How a manifest entry's code blocks are reduced: whether repeats of a value
+# already seen on the page are dropped, the largest size in bytes of a single
+# block, and whether larger blocks are dropped rather than truncated.
+CodePolicy = NamedTuple(
+    "CodePolicy",
+    (("dedupe", bool), ("max_block_bytes", Optional[int]), ("drop_oversized", bool)),
+)
+KEEP_ALL_CODE = CodePolicy(False, None, False)
+
 
 class Facet:
+    __slots__ = ("category", "value", "sub_facets")
+
     def __init__(self, category: str, value: str, sub_facets: List[Any]) -> None:
-        self.category = category
-        self.value = value
-        self.sub_facets = None
+        # Every page repeats the same taxonomy, so the whole manifest shares a
+        # single copy of each category and value string.
+        self.category = _intern(category)
+        self.value = _intern(value)
+        self.sub_facets: Optional[List[Facet]] = None
 
         for sub_facet in sub_facets:
             self.sub_facets = self.sub_facets or []
@@ -29,6 +74,64 @@ class Facet:
             )
 
 
+def _intern(value: Any) -> Any:
+    return intern(value) if type(value) is str else value
+
+
+def _descendant_fields(value: Any, field: str) -> Iterator[Any]:
+    """Yield every value of field in value and its descendants, in the same
+    order as the jsonpath expression $..field, but lazily."""
+    if isinstance(value, dict):
+        if field in value:
+            yield value[field]
+        for child in value.values():
+            yield from _descendant_fields(child, field)
+    elif isinstance(value, list):
+        for child in value:
+            yield from _descendant_fields(child, field)
+
+
+def _child_nodes(tree: Any, node_type: str) -> Iterator[Dict[str, Any]]:
+    """Yield the nodes matched by $..children[?(@.type==node_type)], in order."""
+    for children in _descendant_fields(tree, "children"):
+        if isinstance(children, dict):
+            children = children.values()
+        elif not isinstance(children, list):
+            continue
+        for node in children:
+            if isinstance(node, dict) and node.get("type") == node_type:
+                yield node
+
+
+class Budget:
+    """The bytes remaining for one field of a manifest entry."""
+
+    __slots__ = ("remaining", "exhausted")
+
+    def __init__(self, limit: Optional[int]) -> None:
+        self.remaining = limit
+        self.exhausted = False
+
+    def fit(self, value: str, overhead: int = 0) -> Optional[str]:
+        """Charge value, plus overhead bytes of separators, to the budget.
+        Return value, or the longest prefix of it that fits once the budget
+        runs out, or None if nothing more fits."""
+        if self.remaining is None:
+            return value
+        encoded = value.encode("utf-8")
+        needed = len(encoded) + overhead
+        if needed <= self.remaining:
+            self.remaining -= needed
+            return value
+
+        room = self.remaining - overhead
+        self.remaining = 0
+        self.exhausted = True
+        if room <= 0:
+            return None
+        return encoded[:room].decode("utf-8", "ignore") or None
+
+
 class ManifestEntry(TypedDict):
     slug: str
     title: Optional[str]
@@ -43,8 +146,17 @@ class ManifestEntry(TypedDict):
 class Document:
     """Return indexing data from a page's AST for search purposes."""
 
-    def __init__(self, data) -> None:
+    def __init__(
+        self,
+        data,
+        budgets: FieldBudgets = NO_BUDGETS,
+        code_policy: CodePolicy = KEEP_ALL_CODE,
+    ) -> None:
         self.tree = data[0]
+        self.budgets = budgets
+        self.code_policy = code_policy
+        # Names of the fields cut short by their budget
+        self.truncated: List[str] = []
 
         self.robots, self.keywords, self.description = self.find_metadata()
 
@@ -59,46 +171,81 @@ class Document:
 
     def find_paragraphs(self) -> str:
         logger.debug("Finding paragraphs")
-        # NB: paragraphs include "paragraph" nodes within tables
-        jsonpath_expr = parse("$..children[?(@.type=='paragraph')]..value")
-        results = jsonpath_expr.find(self.tree)
-
+        budget = Budget(self.budgets.paragraphs)
         # Appending to then joining an array is faster than repeatedly concatenating strings
-        str_list = []
-        for r in results:
-            str_list.append(r.value)
+        str_list: List[str] = []
+        # NB: paragraphs include "paragraph" nodes within tables
+        for paragraph in _child_nodes(self.tree, "paragraph"):
+            for value in _descendant_fields(paragraph, "value"):
+                # Every value after the first is preceded by a space
+                fitted = budget.fit(value, 1 if str_list else 0)
+                if fitted is not None:
+                    str_list.append(fitted)
+                if budget.exhausted:
+                    self.truncated.append("paragraphs")
+                    return " ".join(str_list)
 
         return " ".join(str_list)
 
     def find_code(self):
         logger.debug("Finding code")
-        jsonpath_expr = parse("$..children[?(@.type=='code')]")
-        results = jsonpath_expr.find(self.tree)
+        policy = self.code_policy
+        budget = Budget(self.budgets.code)
+        seen = set()
+        capped = False
         code_contents = []
-        for r in results:
-            lang = r.value.get("lang", None)
-            code_contents.append({"lang": lang, "value": r.value["value"]})
-
+        for node in _child_nodes(self.tree, "code"):
+            lang = node.get("lang", None)
+            value = node["value"]
+            # The same snippet is often repeated across driver tabs
+            if policy.dedupe:
+                if value in seen:
+                    continue
+                seen.add(value)
+
+            if policy.max_block_bytes is not None:
+                block = Budget(policy.max_block_bytes).fit(value)
+                if block != value:
+                    capped = True
+                    if policy.drop_oversized or block is None:
+                        continue
+                    value = block
+
+            value = budget.fit(value)
+            if value is not None:
+                code_contents.append({"lang": lang, "value": value})
+            if budget.exhausted:
+                capped = True
+                break
+
+        if capped:
+            self.truncated.append("code")
         return code_contents
 
     def find_headings(self) -> Tuple[Optional[str], Optional[List[str]]]:
         logger.debug("Finding headings and title")
-        # Get all headings nodes
-        jsonpath_expr = parse("$..children[?(@.type=='heading')].children")
-        results = jsonpath_expr.find(self.tree)
-        if len(results) == 0:
+        # The title is always kept in full; the budget covers the other headings
+        budget = Budget(self.budgets.headings)
+        title = None
+        headings: List[str] = []
+        for node in _child_nodes(self.tree, "heading"):
+            if "children" not in node:
+                continue
+            # Some headings consist of multiple text nodes, so we need to glue them together
+            heading = "".join(_descendant_fields(node["children"], "value"))
+            if title is None:
+                title = heading
+                continue
+
+            fitted = budget.fit(heading)
+            if fitted is not None:
+                headings.append(fitted)
+            if budget.exhausted:
+                self.truncated.append("headings")
+                break
+
+        if title is None:
             return None, None
-        headings = []
-        limiting_expr = parse("$..value")
-        # Some headings consist of multiple text nodes, so we need to glue them together
-        for r in results:
-            heading = []
-            parts = limiting_expr.find(r.value)
-            for part in parts:
-                heading.append(part.value)
-            headings.append("".join(heading))
-        title = headings[0]
-        headings.pop(0)
         return title, headings
 
     def derive_slug(self):
@@ -114,6 +261,8 @@ class Document:
         if self.description:
             return self.description
 
+        from jsonpath_ng.ext import parse
+
         # Set preview to the paragraph value that's a child of a 'target' element
         # (for reference pages that lead with a target definition)
         jsonpath_expr_ref = parse(
@@ -147,17 +296,19 @@ class Document:
         document_facets: Dict[str, List[str]] = {}
         HIERARCHY_KEY = ">"
 
-        # recursive function to look within facets.sub_facets<facets[]>
-        def insert_key_values(facet: Facet, prefix: str = ""):
-            key = prefix + facet.category
-            document_facets[key] = document_facets.get(key, [])
-            document_facets[key].append(facet.value)
-            if not facet.sub_facets:
-                return
-            for sub_facet in facet.sub_facets:
-                insert_key_values(
-                    sub_facet, key + HIERARCHY_KEY + facet.value + HIERARCHY_KEY
-                )
+        # recursive function to look within facets.sub_facets<facets[]>. path
+        # holds the categories and values of the enclosing facets, so that each
+        # key is joined once instead of being rebuilt from a growing prefix.
+        def insert_key_values(facet: Facet, path: List[str]):
+            path.append(facet.category)
+            key = _intern(HIERARCHY_KEY.join(path))
+            document_facets.setdefault(key, []).append(facet.value)
+            if facet.sub_facets:
+                path.append(facet.value)
+                for sub_facet in facet.sub_facets:
+                    insert_key_values(sub_facet, path)
+                path.pop()
+            path.pop()
 
         def create_facet(facet_entry: Any):
             facet = Facet(
@@ -165,7 +316,7 @@ class Document:
                 value=facet_entry["value"],
                 sub_facets=facet_entry["sub_facets"] or [],
             )
-            insert_key_values(facet)
+            insert_key_values(facet, [])
 
         try:
             if self.tree["facets"]:
@@ -182,6 +333,8 @@ class Document:
         keywords: Optional[List[str]] = None
         description: Optional[str] = None
 
+        from jsonpath_ng.ext import parse
+
         jsonpath_expr = parse("$..children[?(@.name=='meta')]..options")
         results = jsonpath_expr.find(self.tree)
         if results:
@@ -247,48 +400,206 @@ class Manifest:
         self.url = url
         self.globally = includeInGlobalSearch
         self.documents: List[ManifestEntry] = []
-
-    def add_document(self, document: ManifestEntry) -> None:
-        """Add a document to the manifest"""
+        # Number of documents whose field was cut short, by field name
+        self.truncated: Dict[str, int] = {}
+
+    def add_document(
+        self, document: ManifestEntry, truncated: Iterable[str] = ()
+    ) -> None:
+        """Add a document to the manifest, noting which of its fields were
+        truncated"""
         if document:
             self.documents.append(document)
+            for field in truncated:
+                self.truncated[field] = self.truncated.get(field, 0) + 1
 
     def export(self) -> str:
         """Return the manifest as json."""
-        manifest = {
+        return dumps(self._as_dict(), indent=4)
+
+    def iter_export(self) -> Iterator[str]:
+        """Yield the manifest's json in chunks, without building the whole
+        string in memory."""
+        return JSONEncoder(indent=4).iterencode(self._as_dict())
+
+    def _as_dict(self) -> Dict[str, Any]:
+        return {
             "url": self.url,
             "includeInGlobalSearch": self.globally,
             "documents": self.documents,
         }
-        return dumps(manifest, indent=4)
 
-
-def process_snooty_manifest_bson(data) -> Optional[ManifestEntry]:
+    def shard(
+        self, count: Optional[int] = None, max_bytes: Optional[int] = None
+    ) -> List["Manifest"]:
+        """Split the manifest's documents into count shards of nearly equal
+        length, or into as many shards as are needed to keep each shard's
+        documents within max_bytes of exported json. A document that is larger
+        than max_bytes by itself gets a shard of its own."""
+        groups: List[List[ManifestEntry]] = []
+        if count is not None:
+            count = max(1, min(count, len(self.documents)))
+            quotient, remainder = divmod(len(self.documents), count)
+            start = 0
+            for i in range(count):
+                end = start + quotient + (1 if i < remainder else 0)
+                groups.append(self.documents[start:end])
+                start = end
+        elif max_bytes is not None:
+            group: List[ManifestEntry] = []
+            group_bytes = 0
+            for document in self.documents:
+                size = document_size(document)
+                if group and group_bytes + size > max_bytes:
+                    groups.append(group)
+                    group, group_bytes = [], 0
+                group.append(document)
+                group_bytes += size
+            groups.append(group)
+        else:
+            groups.append(self.documents)
+
+        shards = []
+        for documents in groups:
+            shard = Manifest(self.url, self.globally)
+            shard.documents = documents
+            shards.append(shard)
+        return shards
+
+
+def document_size(document: ManifestEntry) -> int:
+    """Return the number of bytes a document occupies in an exported manifest,
+    where each of its lines is indented by two more levels."""
+    serialized = dumps(document, indent=4)
+    return len(serialized.encode("utf-8")) + 8 * (serialized.count("\n") + 1) + 2
+
+
+def export_shards(
+    manifest: Manifest,
+    output: str,
+    count: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+) -> Dict[str, str]:
+    """Shard a manifest, returning a mapping from file name to json. The shards
+    of e.g. manual.json are named manual-000.json, manual-001.json, and so on,
+    and are followed by an index file, manual-index.json, listing them."""
+    stem, ext = splitext(output)
+    files = {}
+    for i, shard in enumerate(manifest.shard(count, max_bytes)):
+        files["{}-{:03d}{}".format(stem, i, ext)] = shard.export()
+
+    index = {
+        "url": manifest.url,
+        "includeInGlobalSearch": manifest.globally,
+        "shards": list(files),
+    }
+    files["{}-index{}".format(stem, ext)] = dumps(index, indent=4)
+    return files
+
+
+def process_snooty_manifest_bson(
+    data, budgets: FieldBudgets = NO_BUDGETS, code_policy: CodePolicy = KEEP_ALL_CODE
+) -> Optional[ManifestEntry]:
     """Generates manifest info for a BSON document."""
-    document = Document(data).export()
+    document = Document(data, budgets, code_policy).export()
     return document
 
 
 def check_entry(ast_entry: ZipInfo) -> Optional[ZipInfo]:
-    filepath = Path(join(ast_entry.filename))
-    if "documents" in filepath.parts and not set(
-        ["images", "includes", "sharedinclude"]
-    ).intersection(filepath.parts):
+    path = "/" + ast_entry.filename + "/"
+    if (
+        "/documents/" in path
+        and not ast_entry.is_dir()
+        and not any(excluded in path for excluded in EXCLUDED_DIRECTORIES)
+    ):
         return ast_entry
     return None
 
 
-def generate_manifest(archive: str, url: str, includeInGlobalSearch: bool) -> Manifest:
+def select_entries(entries: Iterable[ZipInfo]) -> List[ZipInfo]:
+    """Return the archive members that hold indexable page ASTs."""
+    return [entry for entry in entries if check_entry(entry)]
+
+
+def read_members(
+    archive: str, astfile: ZipFile, entries: List[ZipInfo]
+) -> Iterator[Tuple[Any, int, int]]:
+    """Yield a (buffer, offset, size) triple locating each member's data.
+
+    Stored members are served straight out of a memory map of the archive, so
+    they are never copied onto the heap. Compressed and encrypted members are
+    read normally."""
+    if not any(entry.compress_type == ZIP_STORED for entry in entries):
+        for entry in entries:
+            data = astfile.read(entry)
+            yield data, 0, len(data)
+        return
+
+    with open(archive, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        for entry in entries:
+            if entry.compress_type != ZIP_STORED or entry.flag_bits & 0x1:
+                data = astfile.read(entry)
+                yield data, 0, len(data)
+                continue
+
+            signature, name_length, extra_length = LOCAL_FILE_HEADER.unpack_from(
+                mapped, entry.header_offset
+            )
+            if signature != b"PK\x03\x04":
+                raise BadZipFile("Bad local file header for " + entry.filename)
+
+            offset = (
+                entry.header_offset
+                + LOCAL_FILE_HEADER.size
+                + name_length
+                + extra_length
+            )
+            with memoryview(mapped) as view:
+                crc = zlib.crc32(view[offset : offset + entry.file_size])
+            if crc != entry.CRC:
+                raise BadZipFile("Bad CRC-32 for file " + entry.filename)
+
+            yield mapped, offset, entry.file_size
+
+
+def decode_entry(
+    data: Any, lazy_decode: bool = False, offset: int = 0, size: Optional[int] = None
+) -> List[Any]:
+    """Decode a page's BSON, found at offset in data. In lazy mode, only the
+    fields that can contribute to a manifest entry are materialized."""
+    from bson import decode_all
+
+    if lazy_decode:
+        return [decode_page(data, offset)]
+    if size is None:
+        return decode_all(data)
+    with memoryview(data) as view:
+        return decode_all(view[offset : offset + size])
+
+
+def generate_manifest(
+    archive: str,
+    url: str,
+    includeInGlobalSearch: bool,
+    lazy_decode: bool = False,
+    budgets: FieldBudgets = NO_BUDGETS,
+    code_policy: CodePolicy = KEEP_ALL_CODE,
+) -> Manifest:
     """Process BSON files and compile a manifest."""
     manifest = Manifest(url, includeInGlobalSearch)
 
     with ZipFile(archive, "r") as astfile:
-        for entry in astfile.infolist():
-            if check_entry(entry):
-                doc_to_add = process_snooty_manifest_bson(
-                    decode_all(astfile.read(entry))
-                )
-                if doc_to_add:
-                    manifest.add_document(doc_to_add)
+        entries = select_entries(astfile.infolist())
+        metrics.count("archive members", len(entries))
+        for data, offset, size in read_members(archive, astfile, entries):
+            document = Document(
+                decode_entry(data, lazy_decode, offset, size), budgets, code_policy
+            )
+            doc_to_add = document.export()
+            if doc_to_add:
+                manifest.add_document(doc_to_add, document.truncated)
 
+    metrics.count("documents", len(manifest.documents))
     return manifest
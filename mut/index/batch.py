@@ -0,0 +1,201 @@
+"""Generate, and optionally upload, many manifests in a single process.
+
+A job file is a YAML stream of stanzas such as:
+
+    archive: build/manual-v6.0.zip
+    output: manual-v6.0.json
+    url: https://www.mongodb.com/docs/v6.0
+    global: false
+    ---
+    archive: build/manual-v7.0.zip
+    output: manual-v7.0.json
+    url: https://www.mongodb.com/docs/v7.0
+    global: true
+"""
+
+import os
+import tempfile
+import time
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import yaml
+
+from mut.index.SnootyManifest import (
+    KEEP_ALL_CODE,
+    NO_BUDGETS,
+    CodePolicy,
+    FieldBudgets,
+    generate_manifest,
+)
+from mut import metrics
+from mut.index.s3upload import MAX_CONCURRENCY, PART_SIZE, Uploader
+
+Job = NamedTuple(
+    "Job", (("archive", str), ("output", str), ("url", str), ("globally", bool))
+)
+
+
+class JobResult:
+    """Timing and outcome of one batch job."""
+
+    def __init__(self, job: Job) -> None:
+        self.job = job
+        self.documents = 0
+        self.generate_time = 0.0
+        self.upload_time: Optional[float] = None
+        self.truncated: Dict[str, int] = {}
+        self.unchanged = False
+        self.error: Optional[str] = None
+
+
+def load_jobs(path: str) -> List[Job]:
+    """Read a YAML job file."""
+    jobs = []
+    with open(path, "r") as f:
+        for stanza in yaml.safe_load_all(f):
+            if stanza is None:
+                continue
+            try:
+                jobs.append(
+                    Job(
+                        str(stanza["archive"]),
+                        str(stanza["output"]),
+                        str(stanza["url"]),
+                        bool(stanza.get("global", False)),
+                    )
+                )
+            except (KeyError, TypeError):
+                raise ValueError(
+                    'Error reading {}: Each job needs "archive", "output" and "url" '
+                    "fields".format(path)
+                )
+    return jobs
+
+
+GenerateResult = Tuple[int, float, Dict[str, int]]
+
+
+def _generate(
+    job: Job,
+    directory: str,
+    lazy_decode: bool,
+    budgets: FieldBudgets,
+    code_policy: CodePolicy,
+) -> GenerateResult:
+    """Process pool worker: write a job's manifest into directory, returning
+    the number of documents, the time taken, and the truncation counts."""
+    start = time.perf_counter()
+    manifest = generate_manifest(
+        job.archive, job.url, job.globally, lazy_decode, budgets, code_policy
+    )
+    path = os.path.join(directory, job.output)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.writelines(manifest.iter_export())
+    return len(manifest.documents), time.perf_counter() - start, manifest.truncated
+
+
+def _upload(uploader: Uploader, result: JobResult, path: Path) -> None:
+    start = time.perf_counter()
+    if not uploader.upload(result.job.output, path, progress=False):
+        result.error = "upload failed"
+    elif result.job.output in uploader.skipped:
+        result.unchanged = True
+    result.upload_time = time.perf_counter() - start
+    metrics.record("upload", result.upload_time)
+
+
+def run_batch(
+    jobs: List[Job],
+    n_workers: Optional[int] = None,
+    lazy_decode: bool = False,
+    budgets: FieldBudgets = NO_BUDGETS,
+    code_policy: CodePolicy = KEEP_ALL_CODE,
+    bucket: Optional[str] = None,
+    prefix: str = "search-indexes",
+    part_size: int = PART_SIZE,
+    concurrency: int = MAX_CONCURRENCY,
+    force: bool = False,
+) -> List[JobResult]:
+    """Generate every job's manifest in a process pool. If a bucket is given,
+    each manifest is uploaded over one shared s3 connection as soon as it is
+    generated, unless it is unchanged; otherwise it is written to the job's
+    output path."""
+    results = [JobResult(job) for job in jobs]
+    uploader = None
+    if bucket:
+        uploader = Uploader(bucket, prefix, part_size, concurrency, force)
+
+    with tempfile.TemporaryDirectory() as tmpdir, ProcessPoolExecutor(
+        n_workers
+    ) as pool, ThreadPoolExecutor() as upload_pool:
+        directory = tmpdir if uploader else "."
+        futures: Dict["Future[GenerateResult]", JobResult] = {
+            pool.submit(
+                _generate, result.job, directory, lazy_decode, budgets, code_policy
+            ): result
+            for result in results
+        }
+        uploads = []
+        for future in as_completed(futures):
+            result = futures[future]
+            try:
+                (
+                    result.documents,
+                    result.generate_time,
+                    result.truncated,
+                ) = future.result()
+            except Exception as err:
+                result.error = str(err) or type(err).__name__
+                metrics.count("errors")
+                continue
+
+            # Workers run in other processes, so record their timings here
+            metrics.record("generate", result.generate_time)
+            metrics.count("documents", result.documents)
+
+            if uploader:
+                path = Path(directory, result.job.output)
+                uploads.append(upload_pool.submit(_upload, uploader, result, path))
+
+        for upload in uploads:
+            upload.result()
+
+    return results
+
+
+def print_results(results: List[JobResult]) -> None:
+    """Print a table of per-job timings."""
+    rows = [("output", "documents", "truncated", "generate", "upload", "status")]
+    for result in results:
+        rows.append(
+            (
+                result.job.output,
+                str(result.documents),
+                " ".join(
+                    "{}:{}".format(field, count)
+                    for field, count in sorted(result.truncated.items())
+                )
+                or "-",
+                "{:.2f}s".format(result.generate_time),
+                (
+                    "{:.2f}s".format(result.upload_time)
+                    if result.upload_time is not None
+                    else "-"
+                ),
+                result.error or ("unchanged" if result.unchanged else "ok"),
+            )
+        )
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    print()
+    for row in rows:
+        line = "  ".join(cell.ljust(width) for cell, width in zip(row, widths))
+        print(line.rstrip())
@@ -0,0 +1,212 @@
+"""
+Benchmark manifest generation over a synthetic snooty archive. Run with
+`python -m mut.index.benchmark`.
+
+Usage:
+    mut.index.benchmark [-n <pages>] [-d <depth>] [-r <repeat>] [-f <facets>]
+                        [--archive <path>] [--deflate] [--lazy-decode] [--json]
+
+    -h, --help               List CLI prototype, arguments, and options.
+    -n, --pages <pages>      Number of pages in the synthetic archive. [default: 100]
+    -d, --depth <depth>      Extra levels of section nesting wrapped around each
+                             page's AST. [default: 0]
+    -r, --repeat <repeat>    Number of timed runs. The fastest run is reported.
+                             [default: 3]
+    -f, --facets <facets>    Number of top-level facets, each with two levels of
+                             sub-facets, given to every page. [default: 0]
+    --archive <path>         Write the synthetic archive to this path instead of
+                             a temporary file, and keep it afterwards.
+    --deflate                Compress archive members instead of storing them.
+    --lazy-decode            Benchmark mut-index's lazy decoding mode.
+    --json                   Print the report as json.
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+from json import dumps
+from pathlib import Path
+from typing import Any, Dict, List
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+from bson import decode_all, encode
+from docopt import docopt
+
+from mut.index.SnootyManifest import (
+    Manifest,
+    decode_entry,
+    generate_manifest,
+    process_snooty_manifest_bson,
+    read_members,
+    select_entries,
+)
+
+FIXTURE_PATH = Path(__file__).parent.parent / "test_data_index" / "documents"
+PHASES = ("zip read", "bson decode", "ast extraction", "json export")
+
+
+def load_fixture_pages() -> List[Dict[str, Any]]:
+    """Return the decoded page documents from the mut-index test fixtures."""
+    pages = []
+    for path in sorted(FIXTURE_PATH.glob("**/*.bson")):
+        pages.extend(decode_all(path.read_bytes()))
+    return pages
+
+
+def nest_ast(ast: Dict[str, Any], depth: int) -> Dict[str, Any]:
+    """Wrap the children of an AST root in depth levels of section nodes."""
+    children = ast["children"]
+    for _ in range(depth):
+        children = [
+            {
+                "type": "section",
+                "position": {"start": {"line": 0}},
+                "children": children,
+            }
+        ]
+    return dict(ast, children=children)
+
+
+def synthetic_facets(n_facets: int) -> List[Dict[str, Any]]:
+    """Return a taxonomy of n_facets top-level facets, each with two levels of
+    sub-facets, as found in a snooty page's facets field."""
+
+    def facet(category: str, value: str, sub_facets: List[Any]) -> Dict[str, Any]:
+        return {"category": category, "value": value, "sub_facets": sub_facets}
+
+    return [
+        facet(
+            "target_product",
+            "product-{}".format(i),
+            [
+                facet(
+                    "sub_product",
+                    "sub-product-{}".format(j),
+                    [facet("version", "v{}.0".format(k), []) for k in range(3)],
+                )
+                for j in range(3)
+            ],
+        )
+        for i in range(n_facets)
+    ]
+
+
+def write_synthetic_archive(
+    path: str,
+    n_pages: int,
+    depth: int = 0,
+    compression: int = ZIP_STORED,
+    n_facets: int = 0,
+) -> None:
+    """Write a snooty-style zip archive containing n_pages pages cloned from the
+    test fixtures, along with the non-document entries mut-index must skip."""
+    templates = load_fixture_pages()
+    facets = synthetic_facets(n_facets)
+    with ZipFile(path, "w", compression) as archive:
+        archive.writestr("site.bson", encode({"project": "benchmark"}))
+        for i in range(n_pages):
+            template = templates[i % len(templates)]
+            filename = "page-{}/{}".format(i, template["filename"])
+            page = dict(
+                template, filename=filename, ast=nest_ast(template["ast"], depth)
+            )
+            if facets:
+                page["facets"] = facets
+            data = encode(page)
+            stem = os.path.splitext(filename)[0]
+            archive.writestr("documents/{}.bson".format(stem), data)
+            if i % 10 == 0:
+                archive.writestr("documents/includes/{}.bson".format(i), data)
+                archive.writestr("diagnostics/{}.bson".format(i), encode({}))
+
+
+def time_phases(archive: str, lazy_decode: bool) -> Dict[str, float]:
+    """Run the generate_manifest pipeline, timing each phase separately."""
+    timings = dict.fromkeys(PHASES, 0.0)
+    manifest = Manifest("www.mongodb.com/docs/benchmark", False)
+
+    with ZipFile(archive, "r") as astfile:
+        start = time.perf_counter()
+        members = read_members(archive, astfile, select_entries(astfile.infolist()))
+        while True:
+            member = next(members, None)
+            decode_start = time.perf_counter()
+            timings["zip read"] += decode_start - start
+            if member is None:
+                break
+
+            data = decode_entry(member[0], lazy_decode, member[1], member[2])
+            extract_start = time.perf_counter()
+            doc_to_add = process_snooty_manifest_bson(data)
+            if doc_to_add:
+                manifest.add_document(doc_to_add)
+            start = time.perf_counter()
+
+            timings["bson decode"] += extract_start - decode_start
+            timings["ast extraction"] += start - extract_start
+
+    start = time.perf_counter()
+    manifest.export()
+    timings["json export"] = time.perf_counter() - start
+    return timings
+
+
+def measure_peak_memory(archive: str, lazy_decode: bool) -> int:
+    """Return the peak traced allocation, in bytes, of generating and exporting
+    a manifest."""
+    tracemalloc.start()
+    try:
+        generate_manifest(
+            archive, "www.mongodb.com/docs/benchmark", False, lazy_decode
+        ).export()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(archive: str, repeat: int, lazy_decode: bool) -> Dict[str, Any]:
+    """Benchmark an archive, returning the fastest run's phase timings and the
+    peak memory use."""
+    runs = [time_phases(archive, lazy_decode) for _ in range(repeat)]
+    best = min(runs, key=lambda run: sum(run.values()))
+    return {
+        "archive_bytes": os.path.getsize(archive),
+        "timings": best,
+        "total": sum(best.values()),
+        "peak_memory_bytes": measure_peak_memory(archive, lazy_decode),
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    justify = max(len(phase) for phase in PHASES) + 1
+    print("archive size: {:.1f} MiB".format(report["archive_bytes"] / 1024 / 1024))
+    for phase, seconds in report["timings"].items():
+        print("{} {:8.3f}s".format((phase + ":").ljust(justify), seconds))
+    print("{} {:8.3f}s".format("total:".ljust(justify), report["total"]))
+    print("peak memory: {:.1f} MiB".format(report["peak_memory_bytes"] / 1024 / 1024))
+
+
+def main() -> None:
+    options = docopt(__doc__)
+    n_pages = int(options["--pages"])
+    depth = int(options["--depth"])
+    repeat = max(1, int(options["--repeat"]))
+    n_facets = int(options["--facets"])
+    compression = ZIP_DEFLATED if options["--deflate"] else ZIP_STORED
+    lazy_decode = bool(options["--lazy-decode"])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        archive = options["--archive"] or os.path.join(tmpdir, "benchmark.zip")
+        write_synthetic_archive(archive, n_pages, depth, compression, n_facets)
+        report = run_benchmark(archive, repeat, lazy_decode)
+
+    report.update(pages=n_pages, depth=depth, facets=n_facets, lazy_decode=lazy_decode)
+    if options["--json"]:
+        print(dumps(report, indent=4))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,230 @@
 """
 Usage:
-    mut-index <root> -o <output> -u <url> [-g -s]
+    mut-index <root> -o <output> -u <url> [-g -s] [--lazy-decode]
+              [--shards <count> | --shard-bytes <bytes>]
+              [--paragraph-budget <bytes>] [--code-budget <bytes>]
+              [--heading-budget <bytes>] [--dedupe-code]
+              [--max-code-bytes <bytes> [--drop-oversized-code]]
+              [--metrics-file <path>] [--profile <path>]
     mut-index upload [-b <bucket> -p <prefix>] <root> -o <output> -u <url>
-                     [-g -s]
+                     [-g -s] [--lazy-decode]
+                     [--shards <count> | --shard-bytes <bytes>]
+                     [--paragraph-budget <bytes>] [--code-budget <bytes>]
+                     [--heading-budget <bytes>] [--dedupe-code]
+                     [--max-code-bytes <bytes> [--drop-oversized-code]]
+                     [--part-size <bytes>] [--concurrency <n>] [--force]
+                     [--metrics-file <path>] [--profile <path>]
+    mut-index batch <jobfile> [-j <n>] [--lazy-decode]
+                    [--paragraph-budget <bytes>] [--code-budget <bytes>]
+                    [--heading-budget <bytes>] [--dedupe-code]
+                    [--max-code-bytes <bytes> [--drop-oversized-code]]
+                    [--metrics-file <path>] [--profile <path>]
+    mut-index upload batch [-b <bucket> -p <prefix>] <jobfile> [-j <n>]
+                           [--lazy-decode]
+                           [--paragraph-budget <bytes>] [--code-budget <bytes>]
+                           [--heading-budget <bytes>] [--dedupe-code]
+                           [--max-code-bytes <bytes> [--drop-oversized-code]]
+                           [--part-size <bytes>] [--concurrency <n>] [--force]
+                           [--metrics-file <path>] [--profile <path>]
 
     -h, --help             List CLI prototype, arguments, and options.
     <root>                 Path to the Snooty manifest file.
     -o, --output <output>  File name for the output manifest json. (e.g. manual-v3.2.json)
     -u, --url <url>        Base url of the property.
     -g, --global           Includes the manifest when searching all properties.
+    <jobfile>              Path to a YAML file of jobs, each giving an archive,
+                           output, url and, optionally, global. The jobs are
+                           run in a pool of processes.
+    -j, --jobs <n>         Number of batch jobs to run at once. Defaults to the
+                           number of CPUs.
+    --lazy-decode          Only decode the parts of each page that can appear in
+                           the manifest, lowering peak memory on large pages.
+    --shards <count>       Split the manifest into this many shards, written
+                           alongside an index file listing them. Shards are
+                           uploaded in parallel.
+    --shard-bytes <bytes>  Split the manifest into as many shards as needed to
+                           keep each shard's documents under this size.
+    --paragraph-budget <bytes>
+                           Truncate each document's paragraph text to this
+                           many bytes.
+    --code-budget <bytes>  Limit the total size of each document's code
+                           values, truncating the block that crosses the limit
+                           and dropping the rest.
+    --heading-budget <bytes>
+                           Limit the total size of each document's headings,
+                           not counting its title.
+    --dedupe-code          Drop code blocks whose value repeats one already
+                           seen on the same page.
+    --max-code-bytes <bytes>
+                           Truncate each code block to this many bytes.
+    --drop-oversized-code  Drop code blocks larger than --max-code-bytes
+                           instead of truncating them.
+    --metrics-file <path>  Write timings and counters for the run to this path
+                           as json.
+    --profile <path>       Run under cProfile, writing the statistics to this
+                           path.
 
     -b, --bucket <bucket>  Name of the s3 bucket to upload the index manifest to.
     -p, --prefix <prefix>  Name of the s3 prefix to attached to the manifest.
                            [default: search-indexes]
+    --part-size <bytes>    Size of each part of the multipart upload. Must be
+                           at least 5 MiB. [default: 8388608]
+    --concurrency <n>      Number of parts to upload at once. [default: 10]
+    --force                Upload even if the manifest in the bucket is identical.
 """
 
 from docopt import docopt
-from mut.index.SnootyManifest import generate_manifest
-from mut.index.s3upload import upload_manifest_to_s3
+from mut.index.SnootyManifest import (
+    CodePolicy,
+    FieldBudgets,
+    generate_manifest,
+    export_shards,
+)
+from mut import metrics
 from datetime import datetime
+from typing import Dict
 import logging
+import multiprocessing
+import sys
 
 logger = logging.getLogger(__name__)
 
 
+def get_budgets(options) -> FieldBudgets:
+    """Read the per-field byte budgets from the command line options."""
+    return FieldBudgets(
+        *(
+            int(options[option]) if options[option] else None
+            for option in ("--paragraph-budget", "--code-budget", "--heading-budget")
+        )
+    )
+
+
+def get_code_policy(options) -> CodePolicy:
+    """Read how code blocks are reduced from the command line options."""
+    max_code_bytes = options["--max-code-bytes"]
+    return CodePolicy(
+        bool(options["--dedupe-code"]),
+        int(max_code_bytes) if max_code_bytes else None,
+        bool(options["--drop-oversized-code"]),
+    )
+
+
+def report_truncated(truncated: Dict[str, int]) -> None:
+    for field, count in sorted(truncated.items()):
+        print("Truncated {} in {} documents".format(field, count))
+
+
 def main() -> None:
     """Generate index files."""
+    # Batch workers re-run the frozen binary, which must hand them over to
+    # multiprocessing rather than running main() again
+    multiprocessing.freeze_support()
     print("Start time: {}".format(datetime.now()))
     options = docopt(__doc__)
+    with metrics.instrument(
+        "mut-index", options["--metrics-file"], options["--profile"]
+    ):
+        if options["batch"]:
+            main_batch(options)
+        else:
+            main_manifest(options)
+    print("Finish time: {}".format(datetime.now()))
+
+
+def main_manifest(options) -> None:
+    """Generate a single manifest, uploading it if requested."""
     root = options["<root>"]
     output = options["--output"]
     url = options["--url"]
     globally = options["--global"]
+    lazy_decode = options["--lazy-decode"]
+    shard_count = options["--shards"]
+    shard_bytes = options["--shard-bytes"]
     logger.info("staring manifest generation: {}".format(datetime.now()))
-    manifest = generate_manifest(root, url, globally).export()
+    with metrics.span("generate"):
+        manifest = generate_manifest(
+            root,
+            url,
+            globally,
+            lazy_decode,
+            get_budgets(options),
+            get_code_policy(options),
+        )
+    report_truncated(manifest.truncated)
+
+    sharded = bool(shard_count or shard_bytes)
+    if sharded:
+        with metrics.span("shard"):
+            files = export_shards(
+                manifest,
+                output,
+                int(shard_count) if shard_count else None,
+                int(shard_bytes) if shard_bytes else None,
+            )
 
     if options["upload"]:
+        # Imported here so that local runs never load boto3
+        from mut.index.s3upload import upload_manifest_to_s3, upload_shards_to_s3
+
         bucket = options["--bucket"]
         prefix = options["--prefix"]
+        part_size = int(options["--part-size"])
+        concurrency = int(options["--concurrency"])
+        force = options["--force"]
 
-        upload_manifest_to_s3(bucket, prefix, output, manifest)
+        with metrics.span("upload"):
+            if sharded:
+                upload_shards_to_s3(
+                    bucket, prefix, files, part_size, concurrency, force
+                )
+            else:
+                upload_manifest_to_s3(
+                    bucket,
+                    prefix,
+                    output,
+                    manifest.iter_export(),
+                    part_size,
+                    concurrency,
+                    force,
+                )
+    elif sharded:
+        with metrics.span("write"):
+            for file, contents in files.items():
+                with open("./" + file, "w") as f:
+                    f.write(contents)
     else:
-        with open("./" + output, "w") as file:
-            file.write(manifest)
-    print("Finish time: {}".format(datetime.now()))
+        with metrics.span("write"):
+            with open("./" + output, "w") as f:
+                f.writelines(manifest.iter_export())
+
+
+def main_batch(options) -> None:
+    """Run every job in a job file, uploading the results if requested."""
+    from mut.index.batch import load_jobs, print_results, run_batch
+
+    try:
+        jobs = load_jobs(options["<jobfile>"])
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+
+    upload = options["upload"]
+    results = run_batch(
+        jobs,
+        n_workers=int(options["--jobs"]) if options["--jobs"] else None,
+        lazy_decode=options["--lazy-decode"],
+        budgets=get_budgets(options),
+        code_policy=get_code_policy(options),
+        bucket=options["--bucket"] if upload else None,
+        prefix=options["--prefix"],
+        part_size=int(options["--part-size"]),
+        concurrency=int(options["--concurrency"]),
+        force=options["--force"],
+    )
+    print_results(results)
+    if any(result.error for result in results):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
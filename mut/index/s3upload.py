@@ -1,15 +1,48 @@
 """Upload a json manifest to Amazon s3."""
 
-import boto3
-from botocore.exceptions import ClientError, ParamValidationError
-from typing import Any
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Union,
+    cast,
+)
 
+from mut import metrics
 from mut.AuthenticationInfo import AuthenticationInfo
 from mut.index.utils.AwaitResponse import wait_for_response
 from mut.index.utils.Logger import log_unsuccessful
 
+# boto3 is imported where it is used, so that runs which never touch s3 don't
+# pay for loading it
+if TYPE_CHECKING:
+    import boto3.s3.transfer
+
+# S3 rejects multipart uploads whose parts, other than the last, are smaller
+MIN_PART_SIZE = 1024 * 1024 * 5
+PART_SIZE = 1024 * 1024 * 8
+MAX_CONCURRENCY = 10
+
+# A manifest to upload: its json as a string, the path of a file holding it,
+# or an iterable of str or bytes chunks such as Manifest.iter_export()
+ManifestSource = Union[str, "os.PathLike[str]", Iterable[Union[str, bytes]]]
+
 
 def _connect_to_s3() -> Any:
+    import boto3.session
+    from botocore.exceptions import ClientError
+
     authentication_info = AuthenticationInfo.load()
     session = boto3.session.Session(
         aws_access_key_id=authentication_info.access_key,
@@ -26,18 +59,128 @@ def _connect_to_s3() -> Any:
         log_unsuccessful("connection", message, ex)
 
 
-def _upload(s3, bucket: str, key: str, manifest: str) -> None:
-    try:
-        wait_for_response(
-            "Attempting to upload to s3 with key: " + key,
-            lambda: s3.Bucket(bucket).put_object(
-                Key=key, Body=manifest, ContentType="application/json"
-            ),
+class _ChunkReader(io.RawIOBase):
+    """A read-only, non-seekable file over an iterable of str or bytes chunks."""
+
+    def __init__(self, chunks: Iterable[Union[str, bytes]]) -> None:
+        self.chunks: Iterator[Union[str, bytes]] = iter(chunks)
+        self.pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        while not self.pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            self.pending = memoryview(chunk)
+
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+
+def _open_manifest(manifest: Union[ManifestSource, IO[bytes]]) -> IO[bytes]:
+    if isinstance(manifest, io.IOBase):
+        return cast(IO[bytes], manifest)
+    if isinstance(manifest, str):
+        return io.BytesIO(manifest.encode("utf-8"))
+    if isinstance(manifest, os.PathLike):
+        return open(manifest, "rb")
+    return io.BufferedReader(_ChunkReader(manifest))
+
+
+def s3_etag(fileobj: IO[bytes], part_size: int = PART_SIZE) -> str:
+    """Return the ETag that s3 assigns to the contents of fileobj when it is
+    uploaded with a transfer_config() of the given part size: the MD5 of the
+    contents, or for a multipart upload, the MD5 of the parts' MD5s followed
+    by the number of parts."""
+    parts = []
+    size = 0
+    while True:
+        data = fileobj.read(part_size)
+        if not data:
+            break
+        size += len(data)
+        parts.append(hashlib.md5(data).digest())
+
+    metrics.count("bytes hashed", size)
+    if size < part_size:
+        return (parts[0] if parts else hashlib.md5(b"").digest()).hex()
+
+    return "{}-{}".format(hashlib.md5(b"".join(parts)).hexdigest(), len(parts))
+
+
+def transfer_config(
+    part_size: int = PART_SIZE, concurrency: int = MAX_CONCURRENCY
+) -> "boto3.s3.transfer.TransferConfig":
+    """Return the managed transfer configuration for uploading manifests in
+    parts of part_size bytes, up to concurrency parts at a time."""
+    import boto3.s3.transfer
+
+    if part_size < MIN_PART_SIZE:
+        raise ValueError(
+            "Part size must be at least {} bytes, not {}".format(
+                MIN_PART_SIZE, part_size
+            )
         )
+
+    return boto3.s3.transfer.TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=concurrency,
+    )
+
+
+def _put(
+    s3,
+    bucket: str,
+    key: str,
+    manifest: Union[ManifestSource, IO[bytes]],
+    config: Any = None,
+) -> None:
+    # Clients, unlike resources, are safe to share between threads
+    with _open_manifest(manifest) as fileobj:
+        s3.meta.client.upload_fileobj(
+            fileobj,
+            bucket,
+            key,
+            ExtraArgs={"ContentType": "application/json"},
+            Config=config or transfer_config(),
+            Callback=lambda n: metrics.count("bytes uploaded", n),
+        )
+    metrics.count("files uploaded")
+
+
+def _upload(
+    s3,
+    bucket: str,
+    key: str,
+    manifest: Union[ManifestSource, IO[bytes]],
+    config: Any = None,
+    progress: bool = True,
+) -> bool:
+    """Upload a manifest, returning whether the upload succeeded."""
+    from boto3.exceptions import S3UploadFailedError
+    from botocore.exceptions import ClientError, ParamValidationError
+
+    try:
+        if progress:
+            wait_for_response(
+                "Attempting to upload to s3 with key: " + key,
+                lambda: _put(s3, bucket, key, manifest, config),
+            )
+        else:
+            _put(s3, bucket, key, manifest, config)
         success_message = ("Successfully uploaded manifest " "to {0} as {1}").format(
             bucket, key
         )
         print(success_message)
+        return True
     except ParamValidationError as ex:
         message = " ".join(
             [
@@ -47,17 +190,122 @@ def _upload(s3, bucket: str, key: str, manifest: str) -> None:
             ]
         )
         log_unsuccessful("upload", message, ex)
-    except ClientError as ex:
+    except (ClientError, S3UploadFailedError) as ex:
         message = "Unable to upload to s3."
         log_unsuccessful("upload", message, ex)
+    return False
+
+
+class Uploader:
+    """Uploads manifests under a bucket prefix over one shared s3 connection.
+    Uploads may be made from several threads at once.
+
+    Unless force is set, a manifest whose contents match the object already
+    in the bucket is not uploaded again; its file name is recorded in
+    skipped instead."""
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str,
+        part_size: int = PART_SIZE,
+        concurrency: int = MAX_CONCURRENCY,
+        force: bool = False,
+    ) -> None:
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/") + "/"
+        self.part_size = part_size
+        self.config = transfer_config(part_size, concurrency)
+        self.force = force
+        self.skipped: List[str] = []
+        self.s3 = _connect_to_s3()
+
+    def remote_etag(self, key: str) -> Optional[str]:
+        """Return the ETag of the object at key, or None if there is none."""
+        from botocore.exceptions import ClientError
 
+        metrics.count("requests")
+        try:
+            response = self.s3.meta.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as ex:
+            if ex.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                log_unsuccessful("head", "Unable to check {}.".format(key), ex)
+            return None
 
-def upload_manifest_to_s3(bucket: str, prefix: str, file: str, manifest: str) -> None:
+        return str(response["ETag"]).strip('"')
+
+    def upload(
+        self, file: str, manifest: ManifestSource, progress: bool = True
+    ) -> bool:
+        """Upload a manifest as the given file name, returning whether the
+        upload succeeded or was unnecessary."""
+        key = self.prefix + file
+        with _open_manifest(manifest) as fileobj:
+            if not self.force:
+                if not fileobj.seekable():
+                    # Hashing consumes the stream, so keep a copy to upload
+                    spool = tempfile.SpooledTemporaryFile(max_size=self.part_size)
+                    shutil.copyfileobj(fileobj, spool)
+                    fileobj = spool
+
+                fileobj.seek(0)
+                etag = s3_etag(fileobj, self.part_size)
+                if etag == self.remote_etag(key):
+                    print(
+                        "Manifest unchanged; not uploading to {0} as {1}".format(
+                            self.bucket, key
+                        )
+                    )
+                    self.skipped.append(file)
+                    return True
+                fileobj.seek(0)
+
+            return _upload(self.s3, self.bucket, key, fileobj, self.config, progress)
+
+
+def upload_manifest_to_s3(
+    bucket: str,
+    prefix: str,
+    file: str,
+    manifest: ManifestSource,
+    part_size: int = PART_SIZE,
+    concurrency: int = MAX_CONCURRENCY,
+    force: bool = False,
+) -> None:
     """
-    Upload the manifest to s3.
+    Upload the manifest to s3, streaming it in parts of part_size bytes. The
+    upload is skipped if the manifest is unchanged, unless force is set.
     """
-    prefix = prefix.rstrip("/") + "/"
-    key = prefix + file
     print("\n### Uploading Manifest to s3\n")
-    s3 = _connect_to_s3()
-    _upload(s3, bucket, key, manifest)
+    uploader = Uploader(bucket, prefix, part_size, concurrency, force)
+    uploader.upload(file, manifest)
+
+
+def upload_shards_to_s3(
+    bucket: str,
+    prefix: str,
+    shards: Dict[str, str],
+    part_size: int = PART_SIZE,
+    concurrency: int = MAX_CONCURRENCY,
+    force: bool = False,
+    n_workers: int = 8,
+) -> None:
+    """
+    Upload a sharded manifest to s3, as produced by export_shards(). The
+    shards are uploaded in parallel; the index, which comes last, is only
+    uploaded once every shard it lists is in place.
+    """
+    *shard_files, index_file = shards
+    print("\n### Uploading {} Manifest Shards to s3\n".format(len(shard_files)))
+    uploader = Uploader(bucket, prefix, part_size, concurrency, force)
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        futures = [
+            pool.submit(uploader.upload, file, shards[file], False)
+            for file in shard_files
+        ]
+        uploaded = all([future.result() for future in futures])
+
+    if not uploaded:
+        print("Not uploading {} because some shards failed".format(index_file))
+        return
+    uploader.upload(index_file, shards[index_file])
@@ -1,9 +1,19 @@
 from bson import decode_all
-from json import loads
+from json import dumps, loads
 from pathlib import Path
 from os import getcwd
 from typing import Optional
-from mut.index.SnootyManifest import ManifestEntry, Document, generate_manifest
+from mut.index.SnootyManifest import (
+    ManifestEntry,
+    CodePolicy,
+    Document,
+    FieldBudgets,
+    decode_entry,
+    export_shards,
+    generate_manifest,
+)
+from mut.index.benchmark import write_synthetic_archive
+from zipfile import ZIP_DEFLATED
 
 ROOT_PATH = Path.cwd() / Path("mut/test_data_index/documents")
 
@@ -145,6 +155,71 @@ def test_findCode() -> None:
     assert document["code"] == expected
 
 
+def test_field_budgets(tmp_path: Path) -> None:
+    data = decode_all(ROOT_PATH.joinpath("introduction.bson").read_bytes())
+    full = Document(data)
+    assert full.truncated == []
+
+    # Paragraphs are cut at the budget, on a character boundary
+    document = Document(data, FieldBudgets(100, None, None))
+    assert document.truncated == ["paragraphs"]
+    assert len(document.paragraphs.encode("utf-8")) == 100
+    assert full.paragraphs.startswith(document.paragraphs)
+
+    # The title is kept in full; the remaining headings share the budget
+    document = Document(data, FieldBudgets(None, None, 20))
+    assert document.truncated == ["headings"]
+    assert document.title == "Introduction to MongoDB"
+    assert document.headings == ["Document Database", "Col"]
+
+    # The code block crossing the budget is truncated, and later ones dropped
+    data = decode_all(ROOT_PATH.joinpath("code-example.bson").read_bytes())
+    document = Document(data, FieldBudgets(None, 40, None))
+    assert document.truncated == ["code"]
+    assert document.code == [
+        {"lang": "python", "value": "a = 1\nb = 2\nprint(a)\nprint(b)"},
+        {"lang": "python", "value": "b = 1\nc = 2"},
+    ]
+
+    # The manifest counts truncated documents by field
+    archive = str(tmp_path / "benchmark.zip")
+    write_synthetic_archive(archive, 11)
+    manifest = generate_manifest(
+        archive, "www.mongodb.com/docs/test", False, budgets=FieldBudgets(1, 1, 1)
+    )
+    assert manifest.truncated["paragraphs"] == len(manifest.documents)
+    assert 0 < manifest.truncated["code"] < len(manifest.documents)
+
+
+def test_code_policy() -> None:
+    data = decode_all(ROOT_PATH.joinpath("code-example.bson").read_bytes())
+    code = data[0]["ast"]["children"][0]["children"]
+    # Repeat the first snippet, as a page with driver tabs would
+    code.append(dict(next(node for node in code if node.get("type") == "code")))
+
+    full = Document(data)
+    assert len(full.code) == 4
+
+    document = Document(data, code_policy=CodePolicy(True, None, False))
+    assert document.code == [
+        block for i, block in enumerate(full.code) if block not in full.code[:i]
+    ]
+    assert len(document.code) == 3
+    assert document.truncated == []
+
+    # Oversized blocks are truncated, or dropped
+    document = Document(data, code_policy=CodePolicy(True, 10, False))
+    assert [block["value"] for block in document.code] == [
+        "a = 1\nb = ",
+        "b = 1\nc = ",
+        "2\n1",
+    ]
+    assert document.truncated == ["code"]
+
+    document = Document(data, code_policy=CodePolicy(False, 10, True))
+    assert document.code == [{"lang": None, "value": "2\n1"}]
+
+
 def test_generate_manifest() -> None:
     # Test standard generation with two unindexable documents out of five
     ast_source_zipped = getcwd() + "/mut/test_data_index/snooty_manifest-zipped.zip"
@@ -157,6 +232,18 @@ def test_generate_manifest() -> None:
     )
     assert len(manifest["documents"]) == 4
 
+    # Test streamed export
+    exported = generate_manifest(ast_source_zipped, url, includeInGlobalSearch)
+    assert "".join(exported.iter_export()) == exported.export()
+
+
+def test_lazy_decode() -> None:
+    # Lazy decoding must not change any manifest entry
+    for path in sorted(ROOT_PATH.glob("**/*.bson")):
+        data = path.read_bytes()
+        expected = Document(decode_all(data)).export()
+        assert Document(decode_entry(data, lazy_decode=True)).export() == expected
+
 
 def test_derive_facets() -> None:
     # Test facets derived from page
@@ -169,3 +256,89 @@ def test_derive_facets() -> None:
     }
     assert document
     assert document["facets"] == expected
+
+
+def test_derive_nested_facets(tmp_path: Path) -> None:
+    # Keys join every enclosing category and value; strings are shared by pages
+    archive = str(tmp_path / "benchmark.zip")
+    write_synthetic_archive(archive, 2, n_facets=2)
+    documents = generate_manifest(archive, "www.mongodb.com/docs/test", False).documents
+
+    facets, other = documents[0]["facets"], documents[1]["facets"]
+    assert facets and other
+    assert facets["target_product"] == ["product-0", "product-1"]
+    assert facets["target_product>product-1>sub_product"] == [
+        "sub-product-0",
+        "sub-product-1",
+        "sub-product-2",
+    ]
+    assert (
+        len(facets["target_product>product-0>sub_product>sub-product-2>version"]) == 3
+    )
+    assert len(facets) == 9
+
+    assert facets == other
+    for key, other_key in zip(facets, other):
+        assert key is other_key
+        assert facets[key][0] is other[other_key][0]
+
+
+def test_synthetic_archive(tmp_path: Path) -> None:
+    # Each fixture page is cloned once; includes and diagnostics must be skipped
+    archive = str(tmp_path / "benchmark.zip")
+    write_synthetic_archive(archive, 11, depth=2)
+
+    manifest = loads(
+        generate_manifest(archive, "www.mongodb.com/docs/test", False).export()
+    )
+    assert len(manifest["documents"]) == 8
+    assert "page-0/code-example" in [doc["slug"] for doc in manifest["documents"]]
+
+
+def test_read_members(tmp_path: Path) -> None:
+    # Memory-mapped stored members and decompressed members must decode the same
+    stored = str(tmp_path / "stored.zip")
+    deflated = str(tmp_path / "deflated.zip")
+    write_synthetic_archive(stored, 11)
+    write_synthetic_archive(deflated, 11, compression=ZIP_DEFLATED)
+
+    url = "www.mongodb.com/docs/test"
+    for lazy_decode in (False, True):
+        assert (
+            generate_manifest(stored, url, False, lazy_decode).export()
+            == generate_manifest(deflated, url, False, lazy_decode).export()
+        )
+
+
+def test_export_shards(tmp_path: Path) -> None:
+    archive = str(tmp_path / "benchmark.zip")
+    write_synthetic_archive(archive, 22)
+    manifest = generate_manifest(archive, "www.mongodb.com/docs/test", True)
+    slugs = [doc["slug"] for doc in manifest.documents]
+
+    # Split by count
+    files = export_shards(manifest, "test.json", count=3)
+    assert list(files) == [
+        "test-000.json",
+        "test-001.json",
+        "test-002.json",
+        "test-index.json",
+    ]
+    index = loads(files["test-index.json"])
+    assert index["shards"] == list(files)[:-1]
+    assert index["includeInGlobalSearch"]
+    shards = [loads(files[name]) for name in index["shards"]]
+    assert [len(shard["documents"]) for shard in shards] == [6, 5, 5]
+    assert [doc["slug"] for shard in shards for doc in shard["documents"]] == slugs
+
+    # Split by size: every shard except oversized single documents fits the budget
+    max_bytes = 4 * 1024
+    files = export_shards(manifest, "test.json", max_bytes=max_bytes)
+    index = loads(files["test-index.json"])
+    assert len(index["shards"]) > 1
+    shards = [loads(files[name]) for name in index["shards"]]
+    assert [doc["slug"] for shard in shards for doc in shard["documents"]] == slugs
+    for name, shard in zip(index["shards"], shards):
+        empty = dict(shard, documents=[])
+        overhead = len(dumps(empty, indent=4))
+        assert len(shard["documents"]) == 1 or len(files[name]) - overhead <= max_bytes
@@ -0,0 +1,43 @@
+import os
+from json import loads
+from pathlib import Path
+
+import pytest
+
+from mut.index.batch import load_jobs, run_batch
+from mut.index.benchmark import write_synthetic_archive
+
+
+def test_run_batch(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    write_synthetic_archive(str(tmp_path / "a.zip"), 11)
+    write_synthetic_archive(str(tmp_path / "b.zip"), 22)
+    jobfile = tmp_path / "jobs.yaml"
+    jobfile.write_text(
+        "archive: a.zip\noutput: a.json\nurl: www.mongodb.com/docs/a\n"
+        "---\n"
+        "archive: b.zip\noutput: nested/b.json\nurl: www.mongodb.com/docs/b\n"
+        "global: true\n"
+        "---\n"
+        "archive: missing.zip\noutput: c.json\nurl: www.mongodb.com/docs/c\n"
+    )
+    monkeypatch.chdir(tmp_path)
+
+    jobs = load_jobs(str(jobfile))
+    assert [job.globally for job in jobs] == [False, True, False]
+
+    results = run_batch(jobs, n_workers=2)
+    assert [result.documents for result in results] == [8, 16, 0]
+    assert [bool(result.error) for result in results] == [False, False, True]
+
+    manifest = loads((tmp_path / "nested" / "b.json").read_text())
+    assert manifest["url"] == "www.mongodb.com/docs/b"
+    assert manifest["includeInGlobalSearch"]
+    assert len(manifest["documents"]) == 16
+    assert not os.path.exists(tmp_path / "c.json")
+
+
+def test_load_jobs_requires_fields(tmp_path: Path) -> None:
+    jobfile = tmp_path / "jobs.yaml"
+    jobfile.write_text("archive: a.zip\nurl: www.mongodb.com/docs/a\n")
+    with pytest.raises(ValueError):
+        load_jobs(str(jobfile))
@@ -0,0 +1,119 @@
+import hashlib
+import io
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+from botocore.exceptions import ClientError
+
+from mut.index import s3upload
+from mut.index.s3upload import (
+    MIN_PART_SIZE,
+    PART_SIZE,
+    Uploader,
+    _open_manifest,
+    _upload,
+    s3_etag,
+    transfer_config,
+)
+
+
+class FakeClient:
+    def __init__(self) -> None:
+        self.uploads: Dict[str, bytes] = {}
+        self.calls = 0
+
+    def upload_fileobj(self, fileobj: Any, bucket: str, key: str, **kwargs) -> None:
+        # Read in parts, the way a managed multipart transfer would
+        self.calls += 1
+        parts: List[bytes] = []
+        while True:
+            part = fileobj.read(kwargs["Config"].multipart_chunksize)
+            if not part:
+                break
+            parts.append(part)
+        self.uploads[bucket + "/" + key] = b"".join(parts)
+
+    def head_object(self, Bucket: str, Key: str) -> Dict[str, str]:
+        try:
+            data = self.uploads[Bucket + "/" + Key]
+        except KeyError:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {"ETag": '"{}"'.format(s3_etag(io.BytesIO(data), MIN_PART_SIZE))}
+
+
+class FakeMeta:
+    def __init__(self) -> None:
+        self.client = FakeClient()
+
+
+class FakeS3:
+    def __init__(self) -> None:
+        self.meta = FakeMeta()
+
+
+def test_open_manifest(tmp_path: Path) -> None:
+    manifest = '{"url": "www.mongodb.com/docs/test", "documents": ["é"]}'
+    path = tmp_path / "manifest.json"
+    path.write_text(manifest, encoding="utf-8")
+    chunks = (manifest[i : i + 3] for i in range(0, len(manifest), 3))
+
+    for source in (manifest, path, chunks):
+        with _open_manifest(source) as f:
+            assert f.read() == manifest.encode("utf-8")
+
+
+def test_upload_streams_parts() -> None:
+    s3 = FakeS3()
+    config = transfer_config()
+    chunk = "x" * 1000
+    chunks = (chunk for _ in range(PART_SIZE // 1000 * 2 + 1))
+
+    assert _upload(s3, "bucket", "manifest.json", chunks, config, progress=False)
+    uploaded = s3.meta.client.uploads["bucket/manifest.json"]
+    assert len(uploaded) == (PART_SIZE // 1000 * 2 + 1) * 1000
+
+
+def test_transfer_config() -> None:
+    config = transfer_config(PART_SIZE, 4)
+    assert config.multipart_chunksize == PART_SIZE
+    assert config.max_concurrency == 4
+
+    with pytest.raises(ValueError):
+        transfer_config(1024)
+
+
+def test_s3_etag() -> None:
+    data = b"x" * (MIN_PART_SIZE * 2 + 1)
+    assert s3_etag(io.BytesIO(b"abc"), MIN_PART_SIZE) == hashlib.md5(b"abc").hexdigest()
+    assert s3_etag(io.BytesIO(b""), MIN_PART_SIZE) == hashlib.md5(b"").hexdigest()
+
+    parts = [data[:MIN_PART_SIZE], data[MIN_PART_SIZE:-1], data[-1:]]
+    digests = b"".join(hashlib.md5(part).digest() for part in parts)
+    expected = hashlib.md5(digests).hexdigest() + "-3"
+    assert s3_etag(io.BytesIO(data), MIN_PART_SIZE) == expected
+
+
+def test_skip_unchanged(monkeypatch: pytest.MonkeyPatch) -> None:
+    s3 = FakeS3()
+    monkeypatch.setattr(s3upload, "_connect_to_s3", lambda: s3)
+    uploader = Uploader("bucket", "prefix", MIN_PART_SIZE)
+
+    assert uploader.upload("a.json", (chunk for chunk in ["{", "}"]), progress=False)
+    assert s3.meta.client.uploads["bucket/prefix/a.json"] == b"{}"
+    assert uploader.skipped == []
+
+    # Identical contents are not uploaded again, unless forced
+    assert uploader.upload("a.json", "{}", progress=False)
+    assert uploader.skipped == ["a.json"]
+    assert s3.meta.client.calls == 1
+
+    uploader.force = True
+    assert uploader.upload("a.json", "{}", progress=False)
+    assert s3.meta.client.calls == 2
+
+    # Changed contents are uploaded
+    uploader.force = False
+    assert uploader.upload("a.json", "[]", progress=False)
+    assert s3.meta.client.uploads["bucket/prefix/a.json"] == b"[]"
+    assert s3.meta.client.calls == 3
@@ -1,20 +1,33 @@
 import sys
-import time
-from concurrent.futures import ThreadPoolExecutor
-from typing import Callable, TypeVar
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Optional, TypeVar
 
 _T = TypeVar("_T")
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """Return the executor shared by every wait_for_response() call."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(4)
+        return _pool
 
 
 def wait_for_response(message: str, function: Callable[[], _T]) -> _T:
-    pool = ThreadPoolExecutor(2)
-    future = pool.submit(function)
+    future = _get_pool().submit(function)
     i = 0
-    while not future.done():
+    while True:
         i += 1
         num_dots = 1 + (i % 5)
         sys.stdout.write("\033[K")
         print(message + num_dots * ".", end="\r")
-        time.sleep(0.33)
+        # Returns as soon as the function does, rather than at the next tick
+        done, _ = wait([future], timeout=0.33)
+        if done:
+            break
     sys.stdout.write("\033[K")
     return future.result()
@@ -1,11 +1,19 @@
 """Usage: mut-intersphinx --update=<configpath>
-                          [--timeout=<timeout>] [-v|--verbose]
+                          [--timeout=<timeout>] [--jobs=<n>]
+                          [--max-age=<seconds>] [--index] [-v|--verbose]
+                          [--metrics-file=<path>] [--profile=<path>]
 mut-intersphinx --version
 
 -h --help               show this
 --update=<configpath>   update
 --timeout=<timeout>     wait <timeout> seconds before giving up [default: 5]
+--jobs=<n>              download up to <n> inventories at once [default: 8]
+--max-age=<seconds>     revalidate inventories fetched more than <seconds> ago
+                        [default: 86400]
+--index                 also write a sqlite index of each inventory beside it
 -v --verbose            turn on additional debugging messages
+--metrics-file=<path>   write timings and counters for the run to <path> as json
+--profile=<path>        run under cProfile, writing the statistics to <path>
 --version               show mut version
 
 """
@@ -13,20 +21,37 @@ mut-intersphinx --version
 import base64
 import datetime
 import email.utils
-import http.client
+import json
 import logging
 import os
 import posixpath
-import urllib.error
-import urllib.request
-import yaml
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple
 
 import docopt
 from . import __version__
+from . import metrics
+
+if TYPE_CHECKING:
+    import requests
 
 MAX_AGE = 60 * 60 * 24 * 1  # One day
+CHUNK_SIZE = 64 * 1024
+# Each inventory's ETag, Last-Modified and fetch time are stored beside it in
+# <inventory>.meta.json
+METADATA_SUFFIX = ".meta.json"
 logger = logging.getLogger(__name__)
 
+Inventory = NamedTuple("Inventory", (("name", str), ("url", str)))
+UpdateResult = NamedTuple(
+    "UpdateResult", (("inventory", Inventory), ("outcome", str), ("seconds", float))
+)
+
+_local = threading.local()
+
 
 def resolve_path(name: str, url: str) -> str:
     """Transform a URL into a filesystem-safe filename."""
@@ -36,36 +61,175 @@ def resolve_path(name: str, url: str) -> str:
     )
 
 
-def update(name: str, url: str, timeout: float) -> None:
+def get_session() -> "requests.Session":
+    """Return the calling thread's session, so that each worker reuses its
+    connections to a host for every inventory it downloads from there."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        import requests
+
+        session = _local.session = requests.Session()
+        session.headers["User-Agent"] = "mut/" + __version__
+    return session
+
+
+def read_metadata(path: str) -> Dict[str, Any]:
+    """Read the cache metadata stored beside an inventory, if any."""
+    try:
+        with open(path + METADATA_SUFFIX, "r") as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    return metadata if isinstance(metadata, dict) else {}
+
+
+def write_metadata(path: str, metadata: Dict[str, Any]) -> None:
+    partial = path + METADATA_SUFFIX + ".tmp"
+    with open(partial, "w") as f:
+        json.dump(metadata, f)
+    os.replace(partial, path + METADATA_SUFFIX)
+
+
+def update(name: str, url: str, timeout: float, max_age: float = MAX_AGE) -> str:
     """Update the intersphinx inventory at the given URL, and download
-    it into build/<filename>.inv"""
+    it into build/<filename>.inv, unless it was fetched less than max_age
+    seconds ago. A cached inventory is revalidated using the ETag and
+    Last-Modified headers recorded beside it. Returns what happened: "fresh",
+    "not modified", "downloaded", or "error"."""
+    import requests
+
     path = os.path.join("./build", resolve_path(name, url))
+    metadata = read_metadata(path)
+    if metadata.get("url") != url:
+        metadata = {}
+
+    headers = {}
     try:
         mtime = os.stat(path).st_mtime
     except FileNotFoundError:
-        mtime = -1
+        mtime = None
+        metadata = {}
 
-    now = datetime.datetime.now().timestamp()
+    if mtime is not None:
+        now = datetime.datetime.now().timestamp()
+        if now < metadata.get("fetched", mtime) + max_age:
+            logger.debug("Still young: %s", url)
+            metrics.count("fresh")
+            return "fresh"
 
-    if now < (mtime + MAX_AGE):
-        logger.debug("Still young: %s", url)
-        return
-
-    request = urllib.request.Request(
-        url, headers={"If-Modified-Since": email.utils.formatdate(mtime)}
-    )
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        headers["If-Modified-Since"] = metadata.get(
+            "last_modified"
+        ) or email.utils.formatdate(mtime, usegmt=True)
 
+    metrics.count("requests")
+    partial = path + ".tmp"
     try:
-        response = urllib.request.urlopen(request, timeout=timeout)
-        with open(path, "wb") as f:
-            f.write(response.read())
-    except urllib.error.HTTPError as err:
-        if err.code == 304:
-            logger.debug("Not modified: %s", url)
-            return
-        logger.error("Error downloading %s: Got %d", url, err.code)
-    except (http.client.HTTPException, urllib.error.URLError) as err:
+        with metrics.span("download"):
+            with get_session().get(
+                url, headers=headers, timeout=timeout, stream=True
+            ) as response:
+                # Read any body of an unsuccessful response, so that its
+                # connection can be reused
+                if response.status_code == 304 or response.status_code >= 400:
+                    response.content
+
+                if response.status_code == 304:
+                    logger.debug("Not modified: %s", url)
+                    metrics.count("not modified")
+                    outcome = "not modified"
+                elif response.status_code >= 400:
+                    logger.error(
+                        "Error downloading %s: Got %d", url, response.status_code
+                    )
+                    metrics.count("errors")
+                    return "error"
+                else:
+                    size = 0
+                    with open(partial, "wb") as f:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            f.write(chunk)
+                            size += len(chunk)
+                    os.replace(partial, path)
+                    metrics.count("bytes downloaded", size)
+                    outcome = "downloaded"
+                    metadata = {}
+    except requests.RequestException as err:
         logger.error("Error downloading %s: %s", url, str(err))
+        metrics.count("errors")
+        return "error"
+    finally:
+        try:
+            os.remove(partial)
+        except FileNotFoundError:
+            pass
+
+    # A 304 response may update the validators, but otherwise keeps them
+    for field, header in (("etag", "ETag"), ("last_modified", "Last-Modified")):
+        if header in response.headers:
+            metadata[field] = response.headers[header]
+    metadata["url"] = url
+    metadata["fetched"] = datetime.datetime.now().timestamp()
+    write_metadata(path, metadata)
+    return outcome
+
+
+def update_index(name: str, url: str) -> None:
+    """Index an inventory, unless its index is already up to date."""
+    from . import inventory as inventory_index
+
+    path = os.path.join("./build", resolve_path(name, url))
+    if not os.path.exists(path) or inventory_index.is_index_current(path):
+        return
+
+    try:
+        with metrics.span("index"):
+            count = inventory_index.write_index(path, posixpath.dirname(url) + "/")
+    except (OSError, ValueError, UnicodeDecodeError, zlib.error) as err:
+        logger.error("Error indexing %s: %s", url, str(err))
+        metrics.count("errors")
+        return
+
+    logger.debug("Indexed %d objects: %s", count, url)
+    metrics.count("objects indexed", count)
+
+
+def timed_update(
+    inventory: Inventory, timeout: float, max_age: float, index: bool
+) -> UpdateResult:
+    """Pool worker: update an inventory, and index it if asked, timing both."""
+    start = time.perf_counter()
+    outcome = update(inventory.name, inventory.url, timeout, max_age)
+    if index:
+        update_index(inventory.name, inventory.url)
+    return UpdateResult(inventory, outcome, time.perf_counter() - start)
+
+
+def update_all(
+    inventories: List[Inventory],
+    timeout: float,
+    n_workers: int,
+    max_age: float = MAX_AGE,
+    index: bool = False,
+) -> List[UpdateResult]:
+    """Update inventories concurrently, logging how long each took. Results
+    are returned in the order given."""
+    with ThreadPoolExecutor(max(1, n_workers)) as pool:
+        futures = [
+            pool.submit(timed_update, inventory, timeout, max_age, index)
+            for inventory in inventories
+        ]
+        results = []
+        for future in futures:
+            result = future.result()
+            logger.info(
+                "%s: %s in %.2fs", result.inventory.url, result.outcome, result.seconds
+            )
+            results.append(result)
+
+    return results
 
 
 def main():
@@ -76,8 +240,12 @@ def main():
         print("mut " + __version__)
         return
 
+    import yaml
+
     update_path = str(options["--update"])
     timeout = float(options["--timeout"])
+    n_workers = int(options["--jobs"])
+    max_age = float(options["--max-age"])
     verbose = options.get("--verbose", False)
 
     if verbose:
@@ -91,17 +259,24 @@ def main():
     except FileExistsError:
         pass
 
-    with open(update_path, "r") as f:
-        for stanza in yaml.safe_load_all(f):
-            try:
-                name = str(stanza["name"])
-                url = str(stanza["url"])
-                update(name.strip(), url.strip(), timeout=timeout)
-            except KeyError:
-                logger.error(
-                    'Error reading %s: Need both a "name" field and a "url" field',
-                    update_path,
-                )
+    with metrics.instrument(
+        "mut-intersphinx", options["--metrics-file"], options["--profile"]
+    ):
+        inventories = []
+        with open(update_path, "r") as f:
+            for stanza in yaml.safe_load_all(f):
+                try:
+                    name = str(stanza["name"])
+                    url = str(stanza["url"])
+                    inventories.append(Inventory(name.strip(), url.strip()))
+                except KeyError:
+                    logger.error(
+                        'Error reading %s: Need both a "name" field and a "url" '
+                        "field",
+                        update_path,
+                    )
+
+        update_all(inventories, timeout, n_workers, max_age, options["--index"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,189 @@
+"""Decoded, indexed copies of Sphinx intersphinx inventories.
+
+An objects.inv file is a zlib-compressed list of every object a project
+documents. mut-intersphinx --index writes each one it downloads to a sqlite
+file beside it, keyed by "<domain>:<role>:<name>", such as
+"py:function:os.path.join", so that looking an object up in any number of
+inventories is an indexed query, without decompressing or parsing them."""
+
+import os
+import re
+import sqlite3
+import zlib
+from typing import IO, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+INDEX_SUFFIX = ".sqlite"
+CHUNK_SIZE = 64 * 1024
+
+# name domain:role priority uri dispname
+ENTRY_PAT = re.compile(r"(.+?)\s+(\S+:\S+)\s+(-?\d+)\s+(\S*)\s+(.*)")
+
+InventoryEntry = NamedTuple(
+    "InventoryEntry",
+    (
+        ("name", str),
+        ("role", str),
+        ("priority", int),
+        ("url", str),
+        ("dispname", str),
+    ),
+)
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+CREATE TABLE objects (
+    key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    role TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    uri TEXT NOT NULL,
+    dispname TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def index_path(inventory_path: str) -> str:
+    return inventory_path + INDEX_SUFFIX
+
+
+def _decompressed_lines(f: IO[bytes]) -> Iterator[str]:
+    decompressor = zlib.decompressobj()
+    buffer = b""
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+        buffer += decompressor.decompress(chunk)
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield line.decode("utf-8")
+
+    buffer += decompressor.flush()
+    if buffer:
+        yield buffer.decode("utf-8")
+
+
+def parse_inventory(f: IO[bytes]) -> Tuple[str, str, Iterator[InventoryEntry]]:
+    """Parse a version 2 inventory, returning the project's name and version,
+    and an iterator over its entries. Each entry's url is relative to the
+    inventory's location, with Sphinx's abbreviations expanded."""
+    header = [f.readline().decode("utf-8").rstrip("\n") for _ in range(4)]
+    if header[0] != "# Sphinx inventory version 2":
+        raise ValueError("Unsupported inventory format: {!r}".format(header[0]))
+    if "zlib" not in header[3]:
+        raise ValueError("Inventory is not compressed with zlib")
+
+    project = header[1][len("# Project: ") :]
+    version = header[2][len("# Version: ") :]
+
+    def entries() -> Iterator[InventoryEntry]:
+        for line in _decompressed_lines(f):
+            match = ENTRY_PAT.match(line.rstrip())
+            if not match:
+                continue
+
+            name, role, priority, uri, dispname = match.groups()
+            if uri.endswith("$"):
+                uri = uri[:-1] + name
+            if dispname == "-":
+                dispname = name
+            yield InventoryEntry(name, role, int(priority), uri, dispname)
+
+    return project, version, entries()
+
+
+def write_index(inventory_path: str, base_url: str) -> int:
+    """Write the index of an inventory downloaded from base_url, replacing
+    any existing index. Returns the number of objects indexed."""
+    path = index_path(inventory_path)
+    partial = path + ".tmp"
+    try:
+        os.remove(partial)
+    except FileNotFoundError:
+        pass
+
+    try:
+        with open(inventory_path, "rb") as f:
+            project, version, entries = parse_inventory(f)
+            connection = sqlite3.connect(partial)
+            try:
+                with connection:
+                    connection.executescript(SCHEMA)
+                    connection.executemany(
+                        "INSERT INTO meta VALUES (?, ?)",
+                        (
+                            ("project", project),
+                            ("version", version),
+                            ("base_url", base_url),
+                        ),
+                    )
+                    # Where an object is listed twice, keep the first, as
+                    # Sphinx does
+                    connection.executemany(
+                        "INSERT OR IGNORE INTO objects VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            (entry.role + ":" + entry.name,) + entry[:]
+                            for entry in entries
+                        ),
+                    )
+                count = connection.execute("SELECT COUNT(*) FROM objects").fetchone()
+            finally:
+                connection.close()
+
+        os.replace(partial, path)
+    finally:
+        try:
+            os.remove(partial)
+        except FileNotFoundError:
+            pass
+
+    return int(count[0])
+
+
+def is_index_current(inventory_path: str) -> bool:
+    try:
+        return (
+            os.stat(index_path(inventory_path)).st_mtime_ns
+            >= os.stat(inventory_path).st_mtime_ns
+        )
+    except FileNotFoundError:
+        return False
+
+
+class InventoryIndex:
+    """A read-only connection to an inventory's index."""
+
+    def __init__(self, inventory_path: str) -> None:
+        self.connection = sqlite3.connect(
+            "file:{}?mode=ro".format(index_path(inventory_path)), uri=True
+        )
+        meta = dict(self.connection.execute("SELECT key, value FROM meta"))
+        self.project = meta["project"]
+        self.version = meta["version"]
+        self.base_url = meta["base_url"]
+
+    def get(self, role: str, name: str) -> Optional[InventoryEntry]:
+        """Look up an object by its "<domain>:<role>", such as "py:class",
+        and name. The entry's url is absolute."""
+        row = self.connection.execute(
+            "SELECT name, role, priority, uri, dispname FROM objects WHERE key = ?",
+            (role + ":" + name,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        name, role, priority, uri, dispname = row
+        return InventoryEntry(name, role, priority, self.base_url + uri, dispname)
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def lookup(
+    indexes: Iterable[InventoryIndex], role: str, name: str
+) -> Optional[InventoryEntry]:
+    """Look up an object in each index in turn, returning the first match."""
+    for index in indexes:
+        entry = index.get(role, name)
+        if entry is not None:
+            return entry
+
+    return None
@@ -0,0 +1,99 @@
+"""Instrumentation shared by the mut tools.
+
+Code records how long each phase takes with span(), and tallies work such as
+bytes hashed or requests made with count(). A tool's main() wraps its run in
+instrument(), which writes the totals as json to the path given by the tool's
+--metrics-file option and, with --profile, runs it under cProfile."""
+
+import contextlib
+import cProfile
+import datetime
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Thread-safe totals of timed spans and counters."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.spans: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        """Add one timing of the named span."""
+        with self.lock:
+            span = self.spans.setdefault(name, {"count": 0, "seconds": 0.0})
+            span["count"] += 1
+            span["seconds"] += seconds
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as the named span."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Increment the named counter."""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self) -> None:
+        with self.lock:
+            self.spans = {}
+            self.counters = {}
+
+    def report(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "spans": {name: dict(span) for name, span in self.spans.items()},
+                "counters": dict(self.counters),
+            }
+
+
+# The process-wide metrics that the module-level helpers record into
+METRICS = Metrics()
+span = METRICS.span
+count = METRICS.count
+record = METRICS.record
+
+
+@contextlib.contextmanager
+def instrument(
+    tool: str, metrics_file: Optional[str] = None, profile: Optional[str] = None
+) -> Iterator[None]:
+    """Collect metrics for a tool's run. On exit, even by sys.exit(), write
+    them as json to metrics_file, and if profile is given, write the cProfile
+    statistics of the run there."""
+    METRICS.reset()
+    started = datetime.datetime.now()
+    start = time.perf_counter()
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None and profile:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            logger.info("Wrote profile to %s", profile)
+
+        if metrics_file:
+            report = {
+                "tool": tool,
+                "started": started.isoformat(),
+                "seconds": time.perf_counter() - start,
+            }
+            report.update(METRICS.report())
+            with open(metrics_file, "w") as f:
+                json.dump(report, f, indent=4)
@@ -0,0 +1,187 @@
+"""Generate many .htaccess files at once, in a process pool.
+
+A job file is a YAML stream of stanzas such as:
+
+    source: config/redirects/manual
+    output: build/manual/.htaccess
+    ---
+    source: config/redirects/compass
+    output: build/compass/.htaccess
+    base_url: https://www.mongodb.com/docs/compass
+
+Each worker process compiles the rule syntax once, and keeps it for every
+job it runs.
+"""
+
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from mut import metrics
+from mut.redirects.redirect_main import parse_source_file
+
+Job = NamedTuple("Job", (("source", str), ("output", str), ("base_url", Optional[str])))
+
+
+class JobResult:
+    """Timing and outcome of one batch job."""
+
+    def __init__(self, job: Job) -> None:
+        self.job = job
+        self.time = 0.0
+        self.have_error = False
+        # Everything the job printed to stderr
+        self.messages: List[str] = []
+
+
+def load_jobs(path: str) -> List[Job]:
+    """Read a YAML job file."""
+    import yaml
+
+    jobs = []
+    with open(path, "r") as f:
+        for stanza in yaml.safe_load_all(f):
+            if stanza is None:
+                continue
+            try:
+                base_url = stanza.get("base_url")
+                jobs.append(
+                    Job(
+                        str(stanza["source"]),
+                        str(stanza["output"]),
+                        str(base_url) if base_url else None,
+                    )
+                )
+            except (AttributeError, KeyError, TypeError):
+                raise ValueError(
+                    'Error reading {}: Each job needs "source" and "output" '
+                    "fields".format(path)
+                )
+
+    check_outputs(jobs)
+    return jobs
+
+
+def glob_jobs(pattern: str, output_name: str) -> List[Job]:
+    """Create a job for each source file matching pattern, writing output_name
+    alongside it."""
+    jobs = [
+        Job(source, os.path.join(os.path.dirname(source), output_name), None)
+        for source in sorted(glob.glob(pattern, recursive=True))
+        if os.path.isfile(source)
+    ]
+    check_outputs(jobs)
+    return jobs
+
+
+def check_outputs(jobs: List[Job]) -> None:
+    """Raise ValueError if two jobs would write the same output, since they
+    would overwrite each other as they ran."""
+    sources = {}  # type: Dict[str, str]
+    for job in jobs:
+        output = os.path.realpath(job.output)
+        if output in sources:
+            raise ValueError(
+                "Both {} and {} would be written to {}. Each job needs its "
+                "own output.".format(sources[output], job.source, job.output)
+            )
+        sources[output] = job.source
+
+
+GenerateResult = Tuple[bool, List[str], float]
+
+
+def _generate(
+    job: Job,
+    output_format: str,
+    sort: bool,
+    collapse_chains: bool,
+    base_url: Optional[str],
+    force: bool,
+) -> GenerateResult:
+    """Process pool worker: generate a job's output, returning whether there
+    were errors, the messages printed, and the time taken."""
+    start = time.perf_counter()
+    stderr = io.StringIO()
+    with contextlib.redirect_stderr(stderr):
+        have_error = parse_source_file(
+            job.source,
+            job.output,
+            collapse_chains,
+            job.base_url or base_url,
+            output_format,
+            sort,
+            force,
+        )
+    return have_error, stderr.getvalue().splitlines(), time.perf_counter() - start
+
+
+def run_batch(
+    jobs: List[Job],
+    n_workers: Optional[int] = None,
+    output_format: str = "htaccess",
+    sort: bool = False,
+    collapse_chains: bool = False,
+    base_url: Optional[str] = None,
+    force: bool = False,
+) -> List[JobResult]:
+    """Generate every job's output in a process pool. A job's base URL takes
+    precedence over the one given here."""
+    results = [JobResult(job) for job in jobs]
+    with ProcessPoolExecutor(n_workers) as pool:
+        futures: Dict["Future[GenerateResult]", JobResult] = {
+            pool.submit(
+                _generate,
+                result.job,
+                output_format,
+                sort,
+                collapse_chains,
+                base_url,
+                force,
+            ): result
+            for result in results
+        }
+        for future in as_completed(futures):
+            result = futures[future]
+            try:
+                result.have_error, result.messages, result.time = future.result()
+            except Exception as err:
+                result.have_error = True
+                result.messages = [str(err) or type(err).__name__]
+
+            # Workers run in other processes, so record their timings here
+            metrics.record("generate", result.time)
+            if result.have_error:
+                metrics.count("errors")
+
+    return results
+
+
+def print_results(results: List[JobResult]) -> None:
+    """Print every job's messages to stderr, prefixed by its source, and then
+    a table of per-job timings."""
+    for result in results:
+        for message in result.messages:
+            print("{}: {}".format(result.job.source, message), file=sys.stderr)
+
+    rows = [("source", "output", "time", "status")]
+    for result in results:
+        rows.append(
+            (
+                result.job.source,
+                result.job.output,
+                "{:.2f}s".format(result.time),
+                "error" if result.have_error else "ok",
+            )
+        )
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    print()
+    for row in rows:
+        line = "  ".join(cell.ljust(width) for cell, width in zip(row, widths))
+        print(line.rstrip())
@@ -0,0 +1,141 @@
+"""
+Benchmark mut-redirects over a synthetic redirects file. Run with
+`python -m mut.redirects.benchmark`.
+
+Usage:
+    mut.redirects.benchmark [-n <lines>] [-v <versions>] [-r <repeat>]
+                            [--source <path>] [--collapse-chains] [--json]
+
+    -h, --help               List CLI prototype, arguments, and options.
+    -n, --lines <lines>      Number of lines in the synthetic redirects file.
+                             [default: 100000]
+    -v, --versions <n>       Number of versions to define. [default: 12]
+    -r, --repeat <repeat>    Number of timed runs. The fastest run is reported.
+                             [default: 3]
+    --source <path>          Write the synthetic redirects file to this path
+                             instead of a temporary file, and keep it afterwards.
+    --collapse-chains        Collapse redirect chains while generating.
+    --json                   Print the report as json.
+"""
+
+import contextlib
+import os
+import tempfile
+import time
+from json import dumps
+from typing import Any, Dict, Iterator, List
+
+from docopt import docopt
+
+from mut.redirects.redirect_main import parse_source_file
+
+# Version ranges covering each form of the rule syntax
+RANGES = (
+    "[{first}-*]",
+    "({first}-*]",
+    "[*-{last})",
+    "[*-{last}]",
+    "[{first}-{last})",
+    "({first}-{last})",
+    "({first}-{last}]",
+    "[{first}-{last}]",
+    "[{first}]",
+    "[*]",
+)
+
+
+def synthetic_lines(n_lines: int, n_versions: int) -> Iterator[str]:
+    """Yield the lines of a redirects file using every kind of statement."""
+    versions = ["v{}.{}".format(i // 4 + 1, i % 4) for i in range(n_versions)]
+    yield "define: prefix docs/benchmark"
+    yield "define: base https://www.mongodb.com/${prefix}"
+    yield "define: versions {}".format(" ".join(versions + ["master"]))
+    yield "symlink: current -> master"
+    yield "symlink: upcoming -> master"
+    yield "symlink: stable -> {}".format(versions[-1])
+    yield ""
+
+    for i in range(n_lines - 7):
+        if i % 50 == 0:
+            yield "# Section {}".format(i // 50)
+        elif i == 1:
+            yield "raw: /legacy-{0} -> ${{base}}/current/page-{0}".format(i)
+        elif i % 50 == 1:
+            # Each legacy page was moved again in the next section, leaving a
+            # chain of redirects
+            yield "raw: /legacy-{} -> /legacy-{}".format(i, i - 50)
+        elif i % 50 == 49:
+            # Overlap the previous rule, as when a range is widened
+            yield "{}[*]: ${{version}}/page-{} -> ${{base}}/${{version}}/topic-{}".format(
+                "temporary " if (i - 1) % 7 == 0 else "", i - 1, (i - 1) % 1000
+            )
+        else:
+            first = versions[i % (n_versions // 2)]
+            last = versions[n_versions // 2 + i % (n_versions // 2)]
+            versions_range = RANGES[i % len(RANGES)].format(first=first, last=last)
+            yield "{}{}: ${{version}}/page-{} -> ${{base}}/${{version}}/topic-{}".format(
+                "temporary " if i % 7 == 0 else "", versions_range, i, i % 1000
+            )
+
+
+def write_synthetic_source(path: str, n_lines: int, n_versions: int) -> None:
+    with open(path, "w") as f:
+        for line in synthetic_lines(n_lines, n_versions):
+            f.write(line)
+            f.write("\n")
+
+
+@contextlib.contextmanager
+def working_directory(path: str) -> Iterator[None]:
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def run_benchmark(
+    source: str, repeat: int, collapse_chains: bool = False
+) -> Dict[str, Any]:
+    """Generate a .htaccess file from source repeat times, returning the
+    fastest run's time and the number of rules written."""
+    timings: List[float] = []
+    with tempfile.TemporaryDirectory() as tmpdir, working_directory(tmpdir):
+        output = os.path.join(tmpdir, ".htaccess")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parse_source_file(source, output, collapse_chains)
+            timings.append(time.perf_counter() - start)
+
+        with open(output) as f:
+            n_rules = sum(1 for _ in f)
+
+    return {"seconds": min(timings), "rules": n_rules}
+
+
+def main() -> None:
+    options = docopt(__doc__)
+    n_lines = int(options["--lines"])
+    n_versions = max(2, int(options["--versions"]))
+    repeat = max(1, int(options["--repeat"]))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = options["--source"] or os.path.join(tmpdir, "redirects")
+        write_synthetic_source(source, n_lines, n_versions)
+        report = run_benchmark(
+            os.path.abspath(source), repeat, options["--collapse-chains"]
+        )
+
+    report.update(lines=n_lines, versions=n_versions)
+    if options["--json"]:
+        print(dumps(report, indent=4))
+    else:
+        print("lines:   {}".format(n_lines))
+        print("rules:   {}".format(report["rules"]))
+        print("time:    {:.3f}s".format(report["seconds"]))
+        print("rules/s: {:.0f}".format(report["rules"] / report["seconds"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Collapse chains of redirects (A -> B, B -> C) so that every source
+redirects straight to its final target."""
+
+import urllib.parse
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    from mut.redirects.redirect_main import RuleDefinition
+
+# The final target of following a source's redirects, whether any of them was
+# temporary, and how many redirects were followed. None marks sources whose
+# redirects end in a cycle.
+Resolution = Optional[Tuple[str, bool, int]]
+
+CollapseResult = NamedTuple(
+    "CollapseResult",
+    [
+        ("rules", List["RuleDefinition"]),
+        ("collapsed", int),
+        ("hops_removed", int),
+        ("cycles", List[List[str]]),
+    ],
+)
+
+
+class SourceMatcher:
+    """Maps a redirect target to the source it would be redirected by again,
+    if it is under the URL the rules' sources are served from. Absolute path
+    targets must be under that URL's path; without a base URL, they are taken
+    to be sources as they are, and no other targets match."""
+
+    def __init__(self, base_url: Optional[str] = None) -> None:
+        self.base_url = ""
+        self.base_path = ""
+        if base_url:
+            self.base_url = base_url.rstrip("/")
+            self.base_path = urllib.parse.urlparse(self.base_url).path
+
+    def __call__(self, url: str) -> Optional[str]:
+        if url.startswith("/") and not url.startswith("//"):
+            prefix = self.base_path
+        elif self.base_url and url.startswith(self.base_url):
+            prefix = self.base_url
+        else:
+            return None
+
+        if url != prefix and not url.startswith(prefix + "/"):
+            return None
+
+        return url[len(prefix) :] or "/"
+
+
+def _resolve(
+    start: str,
+    redirects: Dict[str, Optional[Tuple[str, bool]]],
+    resolved: Dict[str, Resolution],
+    match_source: SourceMatcher,
+    cycles: List[List[str]],
+) -> Resolution:
+    """Follow the redirects from start until reaching a target which is not
+    redirected, memoizing the result for every source passed through."""
+    path = []  # type: List[str]
+    on_path = {}  # type: Dict[str, int]
+    node = start
+    while True:
+        if node in resolved:
+            result = resolved[node]
+            break
+
+        if node in on_path:
+            cycles.append(path[on_path[node] :] + [node])
+            result = None
+            break
+
+        on_path[node] = len(path)
+        path.append(node)
+        redirect = redirects[node]
+        assert redirect is not None
+        target, is_temp = redirect
+        next_node = match_source(target)
+        if next_node is None or redirects.get(next_node) is None:
+            result = (target, is_temp, 1)
+            resolved[path.pop()] = result
+            break
+
+        node = next_node
+
+    for node in reversed(path):
+        if result is not None:
+            redirect = redirects[node]
+            assert redirect is not None
+            result = (result[0], redirect[1] or result[1], result[2] + 1)
+        resolved[node] = result
+
+    return resolved[start]
+
+
+def collapse_chains(
+    rules: List["RuleDefinition"], base_url: Optional[str] = None
+) -> CollapseResult:
+    """Point each rule whose target is redirected again at the end of the
+    chain. A collapsed rule is temporary if any redirect along the chain is.
+    Sources redirected to more than one target are never followed, and rules
+    leading into a cycle are left alone; the cycles are returned."""
+    match_source = SourceMatcher(base_url)
+
+    # The single target of each source, or None if it has several
+    redirects = {}  # type: Dict[str, Optional[Tuple[str, bool]]]
+    for rule in rules:
+        if rule.old_url not in redirects:
+            redirects[rule.old_url] = (rule.new_url, rule.is_temp)
+            continue
+
+        redirect = redirects[rule.old_url]
+        if redirect is not None and redirect[0] == rule.new_url:
+            redirects[rule.old_url] = (rule.new_url, redirect[1] or rule.is_temp)
+        else:
+            redirects[rule.old_url] = None
+
+    resolved = {}  # type: Dict[str, Resolution]
+    cycles = []  # type: List[List[str]]
+    collapsed_rules = []  # type: List[RuleDefinition]
+    collapsed = 0
+    hops_removed = 0
+    for rule in rules:
+        next_node = match_source(rule.new_url)
+        result = None  # type: Resolution
+        if next_node is not None and redirects.get(next_node) is not None:
+            result = _resolve(next_node, redirects, resolved, match_source, cycles)
+
+        if result is None:
+            collapsed_rules.append(rule)
+            continue
+
+        target, is_temp, hops = result
+        collapsed_rules.append(
+            rule._replace(new_url=target, is_temp=rule.is_temp or is_temp)
+        )
+        collapsed += 1
+        hops_removed += hops
+
+    return CollapseResult(collapsed_rules, collapsed, hops_removed, cycles)
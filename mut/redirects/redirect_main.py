@@ -1,35 +1,220 @@
 """
 Usage:
-    mut-redirects <source_path> [-o <output>]
+    mut-redirects <source_path> [-o <output>] [--format <format>] [--sort]
+                  [--collapse-chains] [--validate-against <build_root>]
+                  [--base-url <url>] [--force]
+                  [--metrics-file <path>] [--profile <path>]
+    mut-redirects batch (<jobfile> | --glob <pattern> [--output-name <name>])
+                  [-j <n>] [--format <format>] [--sort] [--force]
+                  [--collapse-chains [--base-url <url>]]
+                  [--metrics-file <path>] [--profile <path>]
 
     -h, --help             List CLI prototype, arguments, and options.
     <source_path>          Path to the file(s) containing redirect rules.
-    -o, --output <output>  File path for the output .htaccess file.
+    -o, --output <output>  File path for the output .htaccess file. It is only
+                           regenerated if the source, the options or mut have
+                           changed since it was last written, as recorded in
+                           a hidden .fingerprint file beside it.
+    <jobfile>              A YAML stream of jobs, each with "source" and
+                           "output" paths and optionally a "base_url".
+    --glob <pattern>       Generate output for every source file matching this
+                           pattern, which may use ** to match directories.
+    --output-name <name>   The name of the file written beside each source
+                           matched by --glob. [default: .htaccess]
+    -j, --jobs <n>         Number of batch jobs to run at once. Defaults to the
+                           number of CPUs.
+    --format <format>      Write "htaccess" Redirect lines, or a "table" of
+                           tab-separated rules giving each source's S3 key,
+                           for mut-publish --redirects. [default: htaccess]
+    --sort                 Write rules in order of their S3 keys. Only use
+                           this where each source is matched exactly, as by
+                           mut-publish, not as a prefix, as by Apache.
+    --collapse-chains      Redirect each source straight to the end of any
+                           chain of redirects its target starts, and report
+                           redirect cycles as errors.
+    --validate-against <build_root>
+                           Report redirects whose targets on the site are
+                           missing from this build directory. The output is
+                           always regenerated when validating.
+    --base-url <url>       The URL the rules' sources are served under, so
+                           that absolute targets on the same site are
+                           followed when collapsing chains, and validated.
+    --force                Regenerate the output even if its inputs are
+                           unchanged.
+    --metrics-file <path>  Write timings and counters for the run to this path
+                           as json.
+    --profile <path>       Run under cProfile, writing the statistics to this
+                           path.
 """
 
 # Spec URL:
 # https://docs.google.com/document/d/1oI2boFmtzvbbvt-uQawY9k_gLSLbW7LQO2RjVkvtRgg/edit?ts=57caf48b
 
 import collections
+import contextlib
+import filecmp
+import multiprocessing
 import os
 import re
 import sys
 import urllib.parse
-from typing import List, Optional, Dict, Tuple, Pattern, IO
+from typing import (
+    Any,
+    Callable,
+    List,
+    Optional,
+    Dict,
+    Iterator,
+    Set,
+    Tuple,
+    IO,
+    Union,
+)
 from docopt import docopt
 
+from mut import metrics
+from mut.redirects import chains, state
+from mut.redirects.validate import TargetIndex, TargetValidator
+from mut.util import REDIRECT_TABLE_HEADER, split_redirect_key
+
 RuleDefinition = collections.namedtuple(
     "RuleDefinition", ("is_temp", "version", "old_url", "new_url", "is_symlink")
 )
 
+# Match regex groups:
+# Group 1: Opening container - ( or [
+# Group 2: Left version number
+# Group 3: Right version number
+# Group 4: Closing container - ) or ]
+# Group 5: Char after Group 4. Must be a colon.
+VERSION_PAT = re.compile(r"([\[\(])([\w.\*]+)(?:-([\w.\*]+))?([\]\)](.))")
+URL_PAT = re.compile(r":(?:[ \t\f\v])(.*)(?:[ \t\f\v]->)(.*)")
+RAW_PAT = re.compile(r"(?:[ \t\f\v])(.*)(?:[ \t\f\v]->)(.*)")
+SUBSTITUTION_PAT = re.compile(r"{(.*?)}", re.DOTALL)
+KEYWORDS = ("define", "symlink", "raw")
+
+# Substituting a value containing any of these characters could create or
+# complete another ${name} reference, which only the sequential replacement in
+# RedirectContext.rule_substitute() resolves correctly.
+TEMPLATE_CHARS = frozenset("${}")
+
+
+class Template:
+    """A URL or definition value, split once into the literal text between its
+    ${name} references so that it can be expanded for each version without
+    searching it again."""
+
+    __slots__ = ("source", "literals", "names", "simple")
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.literals = []  # type: List[str]
+        self.names = []  # type: List[str]
+
+        # Braces not preceded by a "$" are looked up but never replaced, and
+        # names containing "$" or braces may be partly replaced; leave those
+        # to rule_substitute().
+        self.simple = True
+        start = 0
+        for match in SUBSTITUTION_PAT.finditer(source):
+            name = match.group(1)
+            if source[match.start() - 1 : match.start()] != "$":
+                self.simple = False
+            elif not TEMPLATE_CHARS.isdisjoint(name):
+                self.simple = False
+
+            self.literals.append(source[start : match.start() - 1])
+            self.names.append(name)
+            start = match.end()
+        self.literals.append(source[start:])
+
+        self.literals[0] = self.literals[0].lstrip()
+        self.literals[-1] = self.literals[-1].rstrip()
+
+    def __repr__(self) -> str:
+        return "Template({!r})".format(self.source)
+
+
+class HtaccessWriter:
+    """Writes rules to a .htaccess file as they are generated. A rule which
+    repeats the last one written for the same source is skipped, so the first
+    and last redirect for each source, whichever a reader uses, are unchanged.
+    Sources redirected to more than one place are collected in conflicts, and
+    each rule written is passed to validate, if it is set."""
+
+    def __init__(self, f: IO[str]) -> None:
+        self.f = f
+        self.written = 0
+        self.duplicates = 0
+        # Each distinct (is_temp, new_url) redirect for a source that has more
+        # than one
+        self.conflicts = {}  # type: Dict[str, List[Tuple[bool, str]]]
+        self._last = {}  # type: Dict[str, Tuple[bool, str]]
+        self.validate = None  # type: Optional[Callable[[RuleDefinition], None]]
+
+    def write(self, rule: RuleDefinition) -> None:
+        redirect = (rule.is_temp, rule.new_url)
+        last = self._last.get(rule.old_url)
+        if last == redirect:
+            self.duplicates += 1
+            return
+
+        if last is not None:
+            redirects = self.conflicts.setdefault(rule.old_url, [last])
+            if redirect not in redirects:
+                redirects.append(redirect)
+
+        self._last[rule.old_url] = redirect
+        self.f.write(self.format_rule(rule))
+        self.written += 1
+        if self.validate is not None:
+            self.validate(rule)
+
+    def format_rule(self, rule: RuleDefinition) -> str:
+        status = 302 if rule.is_temp else 301
+        return f"Redirect {status} {rule.old_url} {rule.new_url}\n"
+
+
+class TableWriter(HtaccessWriter):
+    """Writes rules as tab-separated rows giving the S3 key for each source,
+    and whether it is a page, so that mut-publish can load them without
+    parsing them again. Tabs within URLs are percent-encoded."""
+
+    def __init__(self, f: IO[str]) -> None:
+        super().__init__(f)
+        f.write(REDIRECT_TABLE_HEADER)
+
+    def format_rule(self, rule: RuleDefinition) -> str:
+        key, is_page = split_redirect_key(rule.old_url)
+        row = (
+            key,
+            "1" if is_page else "0",
+            "302" if rule.is_temp else "301",
+            rule.new_url,
+            rule.old_url,
+        )
+        return "\t".join(field.replace("\t", "%09") for field in row) + "\n"
+
+
+WRITERS = {"htaccess": HtaccessWriter, "table": TableWriter}
+
 
 class RedirectContext:
-    def __init__(self, root: Optional[str]) -> None:
+    def __init__(
+        self, root: Optional[str], writer: Optional[HtaccessWriter] = None
+    ) -> None:
         self.root = root
+        self.writer = writer
+        # Rules are only collected here if there is no writer to stream them to
         self.rules = []  # type: List[RuleDefinition]
         self.symlinks = []  # type: List[Tuple[str, str]]
         self.definitions = {}  # type: Dict[str, str]
         self._versions = None  # type: Optional[List[str]]
+        self._version_positions = {}  # type: Dict[str, int]
+        # The aliases symlinked to each version, in the order they were defined
+        self._aliases = {}  # type: Dict[str, List[str]]
+        # Definitions which can't be substituted directly into a Template
+        self._unsafe_definitions = set()  # type: Set[str]
 
     @property
     def versions(self) -> List[str]:
@@ -38,27 +223,40 @@ class RedirectContext:
 
         return self._versions
 
+    @property
+    def version_positions(self) -> Dict[str, int]:
+        """The position of each version in the versions list."""
+        if not self._version_positions:
+            # Keep the first position of a repeated version, as list.index()
+            for i, version in enumerate(self.versions):
+                self._version_positions.setdefault(version, i)
+
+        return self._version_positions
+
+    def add_symlink(self, alias: str, origin: str) -> None:
+        self.symlinks.append((alias, origin))
+        self._aliases.setdefault(origin, []).append(alias)
+
     def add_definition(self, key: str, value: str) -> None:
         self.definitions[key] = value
+        if TEMPLATE_CHARS.isdisjoint(value):
+            self._unsafe_definitions.discard(key)
+        else:
+            self._unsafe_definitions.add(key)
 
     def generate_rule(
         self,
         is_temp: bool,
         version: str,
-        old_url: str,
-        new_url: str,
+        old_url: Template,
+        new_url: Template,
         is_symlink: bool = False,
     ) -> None:
         # if url contains {version} - substitute in the correct version
-        old_url_sub = self.rule_substitute(old_url, version)
-        new_url_sub = self.rule_substitute(new_url, version)
-
-        # S3 redirects must either have an HTTP scheme *or* have an absolute path
-        parsed_new_url = urllib.parse.urlparse(new_url_sub)
-        if parsed_new_url.scheme not in {
-            "http",
-            "https",
-        } and not parsed_new_url.path.startswith("/"):
+        old_url_sub = self.expand(old_url, version)
+        new_url_sub = self.expand(new_url, version)
+
+        if not is_valid_target(new_url_sub):
             raise ValueError(
                 f"Invalid redirect target: '{new_url_sub}'. Redirect targets must be absolute HTTP URLs."
             )
@@ -71,17 +269,41 @@ class RedirectContext:
         new_rule = RuleDefinition(is_temp, version, old_url_sub, new_url_sub, False)
 
         # check for symlinks
-        if len(self.symlinks) > 0 and version != "raw":
-            for symlink in self.symlinks:
-                if version == symlink[1]:
-                    self.generate_rule(is_temp, symlink[0], old_url, new_url, True)
+        if version != "raw":
+            for alias in self._aliases.get(version, ()):
+                self.generate_rule(is_temp, alias, old_url, new_url, True)
 
-        self.rules.append(new_rule)
+        if self.writer is None:
+            self.rules.append(new_rule)
+        else:
+            self.writer.write(new_rule)
+
+    def expand(self, template: Template, version: str = "") -> str:
+        """Substitute a version and the current definitions into a template.
+        This gives the same result as rule_substitute(), which is used for the
+        templates and values it can't handle directly."""
+        if not template.simple or (
+            version
+            and (version.strip() != version or not TEMPLATE_CHARS.isdisjoint(version))
+        ):
+            return self.rule_substitute(template.source, version)
+
+        literals = template.literals
+        parts = [literals[0]]
+        for i, name in enumerate(template.names, start=1):
+            if name == "version":
+                parts.append(version or "${version}")
+            elif name in self._unsafe_definitions:
+                return self.rule_substitute(template.source, version)
+            else:
+                parts.append(self.definitions[name])
+            parts.append(literals[i])
+
+        return "".join(parts)
 
     def rule_substitute(self, input_string: str, version: str = "") -> str:
         # look for strings between { }
-        sub_regex = "{(.*?)}"
-        matches = re.findall(sub_regex, input_string, re.DOTALL)
+        matches = SUBSTITUTION_PAT.findall(input_string)
         if version != "":
             input_string = input_string.replace("${version}", version)
 
@@ -99,303 +321,415 @@ class RedirectContext:
         return input_string
 
 
+# The statements a line of a redirects file compiles to
+Define = collections.namedtuple("Define", ("key", "value"))
+Symlink = collections.namedtuple("Symlink", ("links",))
+RawRule = collections.namedtuple("RawRule", ("old_url", "new_url"))
+VersionedRule = collections.namedtuple(
+    "VersionedRule",
+    (
+        "line_num",
+        "is_temp",
+        "opening",
+        "first",
+        "last",
+        "closing",
+        "old_url",
+        "new_url",
+    ),
+)
+Statement = Union[Define, Symlink, RawRule, VersionedRule]
+
+
+def is_valid_target(url: str) -> bool:
+    """S3 redirects must either have an HTTP scheme *or* have an absolute path."""
+    # Answer the common cases without urlparse(). Anything it might treat
+    # differently -- a network location after "//", tab or newline characters
+    # it strips, or brackets and non-ASCII hosts it may reject -- takes the
+    # slow path.
+    if url.startswith("/"):
+        if url[1:2] not in "/\t\r\n":
+            return True
+    elif url.startswith(("https://", "http://")):
+        if url.isascii() and "[" not in url and "]" not in url:
+            return True
+
+    parsed_url = urllib.parse.urlparse(url)
+    return parsed_url.scheme in {"http", "https"} or parsed_url.path.startswith("/")
+
+
 def write_to_file(rules: List[RuleDefinition], f: IO[str]) -> None:
+    writer = HtaccessWriter(f)
     for rule in rules:
-        line = "Redirect "
+        writer.write(rule)
 
-        if rule.is_temp:
-            line += "302 "
-        else:
-            line += "301 "
 
-        line += str(rule.old_url) + " " + str(rule.new_url)
-        f.write(line)
-        f.write("\n")
+@contextlib.contextmanager
+def open_output(output: Optional[str]) -> Iterator[IO[str]]:
+    """Open the .htaccess file to stream rules to, replacing any existing file
+    only once every rule has been written."""
+    if output is None:
+        yield sys.stdout
+        return
+
+    partial = output + ".tmp"
+    try:
+        with open(partial, "w") as f:
+            yield f
+
+        # Leave an identical file, and its modification time, alone
+        if not (os.path.isfile(output) and filecmp.cmp(partial, output, shallow=False)):
+            os.replace(partial, output)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(partial)
 
 
-def parse_line(
-    line: str,
-    rc: RedirectContext,
-    line_num: int,
-    version_regex: Pattern,
-    url_regex: Pattern,
-) -> None:
+def compile_line(line: str, line_num: int) -> Optional[Statement]:
+    """Parse a line of a redirects file, returning None if it has no effect."""
     # strip \n from line
     line = line.strip()
-    # regex to see if we are dealing with a keyword - define, symlink, or raw
-    if re.search("^(define|symlink|raw)", line):
-        keyword_split = line.split(":", 1)
+    # keywords - define, symlink, or raw
+    if line.startswith(KEYWORDS):
+        keyword, _, body = line.partition(":")
 
         # define:
-        if keyword_split[0] == "define":
-            value = ""
-            type_split = keyword_split[1].split(" ")
+        if keyword == "define":
+            type_split = body.split(" ")
             key = type_split[1]
 
             if len(type_split) > 3:
-                for x in range(2, len(type_split)):
-                    value = value + type_split[x] + " "
+                value = " ".join(type_split[2:])
             else:
                 value = type_split[2]
 
-            value = value.strip()
-            value = rc.rule_substitute(value)
-            rc.add_definition(key, value)
+            return Define(key, Template(value.strip()))
 
         # grab symlinks:
-        if keyword_split[0] == "symlink" and rc.root is not None:
-            type_split = line.split(":", 1)
-            sym_split = [sym.strip() for sym in type_split[1].split("->")]
-            alias, origin = sym_split
-            alias_path = os.path.join(rc.root, alias)
-
-            try:
-                os.remove(alias_path)
-            except FileNotFoundError:
-                pass
-
-            os.symlink(origin, alias_path)
-            rc.symlinks.append((alias, origin))
+        if keyword == "symlink":
+            return Symlink([sym.strip() for sym in body.split("->")])
 
         # raw redirects:
-        if keyword_split[0] == "raw":
-            p = re.compile("(?:[ \t\f\v])(.*)(?:[ \t\f\v]->)(.*)")
-            match = p.search(line)
-
+        if keyword == "raw":
+            match = RAW_PAT.search(line)
             if match:
-                old_url = match.group(1)
-                new_url = match.group(2)
+                return RawRule(Template(match.group(1)), Template(match.group(2)))
 
-                # get version from new_url
-                rc.generate_rule(False, "raw", old_url, new_url)
+        return None
 
     # for versioning rules:
-    else:
-        match = version_regex.search(line)
-        if match:
-            # Syntax check:
-            # Make sure there is a colon after the version
-            if match.group(5) != ":":
-                raise ValueError("ERROR in line {}: Bad rule syntax".format(line_num))
-
-            # see if we are dealing with a temporary redirect:
-            is_temp = False
-            if line.split(" ")[0] == "temporary":
-                is_temp = True
-
-            # some more regex hieroglyphs to get the old and new redirect urls:
-            old_url = ""
-            new_url = ""
-
-            url_match = url_regex.search(line)
-
-            assert url_match
-            if url_match.group(1):
-                old_url = url_match.group(1)
-            if url_match.group(2):
-                new_url = url_match.group(2)
-
-            # match regex groups:
-            # Group 1: Opening container - ( or [
-            # Group 2: Left version number
-            # Group 3: Right version number
-            # Group 4: Closing container - ) or ]
-            # Group 5: Char after Group 4. Must be a colon.
-
-            # Error checking:
-            # Check if group 2 and/or 3 are '*' or in version array
-            # If not, error.
-            # Process accordingly based on brackets in groups 1 and 4
-            if match.group(2) not in rc.versions and match.group(2) != "*":
-                raise ValueError(
-                    "ERROR in line {}: Version {} not present in version list".format(
-                        line_num, match.group(2)
-                    )
+    match = VERSION_PAT.search(line)
+    if not match:
+        return None
+
+    # Syntax check:
+    # Make sure there is a colon after the version
+    if match.group(5) != ":":
+        raise ValueError("ERROR in line {}: Bad rule syntax".format(line_num))
+
+    # see if we are dealing with a temporary redirect:
+    is_temp = line.split(" ")[0] == "temporary"
+
+    # some more regex hieroglyphs to get the old and new redirect urls:
+    url_match = URL_PAT.search(line)
+    assert url_match
+
+    return VersionedRule(
+        line_num,
+        is_temp,
+        match.group(1),
+        match.group(2),
+        match.group(3),
+        match.group(4)[0],
+        Template(url_match.group(1)),
+        Template(url_match.group(2)),
+    )
+
+
+def select_versions(rule: VersionedRule, rc: RedirectContext) -> List[str]:
+    """Return the versions covered by a rule's range, in order."""
+    versions = rc.versions
+    positions = rc.version_positions
+
+    # Error checking:
+    # Check if the first and last versions are '*' or in version array
+    # If not, error.
+    # Process accordingly based on the opening and closing brackets
+    for version in (rule.first, rule.last):
+        if version is not None and version != "*" and version not in positions:
+            raise ValueError(
+                "ERROR in line {}: Version {} not present in version list".format(
+                    rule.line_num, version
                 )
-            elif match.group(3):
-                if match.group(3) not in rc.versions and match.group(3) != "*":
-                    raise ValueError(
-                        "ERROR in line {}: Version {} not present in version list".format(
-                            line_num, match.group(3)
-                        )
-                    )
-                if match.group(2) != "*":
-                    begin_index = rc.versions.index(match.group(2))
-                if match.group(3) != "*":
-                    end_index = rc.versions.index(match.group(3))
-
-                if (match.group(1) == "(" and match.group(2) == "*") or (
-                    match.group(3) == "*" and match.group(4)[0] == ")"
-                ):
-                    # this should throw an error based on the spec
-                    raise ValueError("ERROR: Bad formatting in line " + str(line_num))
-
-                # (v2.0 - *]
-                elif (
-                    match.group(1) == "("
-                    and match.group(2) != "*"
-                    and match.group(3) == "*"
-                    and match.group(4)[0] == "]"
-                ):
-                    for x in range(begin_index + 1, len(rc.versions)):
-                        version = rc.versions[x]
-                        rc.generate_rule(is_temp, version, old_url, new_url)
-
-                # (v2.0 - v3.0) ERROR
-                elif (
-                    match.group(1) == "("
-                    and match.group(2) != "*"
-                    and match.group(3) != "*"
-                    and match.group(4)[0] == ")"
-                ):
-                    # make sure we are actually including at least one version:
-                    if begin_index == end_index:
-                        raise ValueError(
-                            "ERROR: No versions included in line " + str(line_num)
-                        )
-
-                    for x in range(begin_index + 1, end_index):
-                        version = rc.versions[x]
-                        rc.generate_rule(is_temp, version, old_url, new_url)
-
-                # (v2.0 - v3.0]
-                elif (
-                    match.group(1) == "("
-                    and match.group(2) != "*"
-                    and match.group(3) != "*"
-                    and match.group(4)[0] == "]"
-                ):
-                    for x in range(begin_index + 1, end_index + 1):
-                        version = rc.versions[x]
-                        rc.generate_rule(is_temp, version, old_url, new_url)
-
-                # [* - *] ERROR
-                elif (
-                    match.group(1) == "["
-                    and match.group(2) == "*"
-                    and match.group(3) == "*"
-                ):
-                    # raise an error here because [* - * should be a raw redirect
-                    raise ValueError("ERROR: Bad formatting in line " + str(line_num))
-
-                # [* - v3.0)
-                elif (
-                    match.group(1) == "["
-                    and match.group(2) == "*"
-                    and match.group(3) != "*"
-                    and match.group(4)[0] == ")"
-                ):
-                    for x in range(0, end_index):
-                        version = rc.versions[x]
-                        rc.generate_rule(is_temp, version, old_url, new_url)
-
-                # [* - v3.0]
-                elif (
-                    match.group(1) == "["
-                    and match.group(2) == "*"
-                    and match.group(3) != "*"
-                    and match.group(4)[0] == "]"
-                ):
-                    for x in range(0, end_index + 1):
-                        version = rc.versions[x]
-                        rc.generate_rule(is_temp, version, old_url, new_url)
-
-                # [v2.0 - *]
-                elif (
-                    match.group(1) == "["
-                    and match.group(2) != "*"
-                    and match.group(3) == "*"
-                    and match.group(4)[0] == "]"
-                ):
-                    for x in range(begin_index, len(rc.versions)):
-                        version = rc.versions[x]
-                        rc.generate_rule(is_temp, version, old_url, new_url)
-
-                # [v2.0 - v3.0)
-                elif (
-                    match.group(1) == "["
-                    and match.group(2) != "*"
-                    and match.group(3) != "*"
-                    and match.group(4)[0] == ")"
-                ):
-                    for x in range(begin_index, end_index):
-                        version = rc.versions[x]
-                        rc.generate_rule(is_temp, version, old_url, new_url)
-
-                # [v2.0 - v3.0]
-                elif (
-                    match.group(1) == "["
-                    and match.group(2) != "*"
-                    and match.group(3) != "*"
-                    and match.group(4)[0] == "]"
-                ):
-                    for x in range(begin_index, end_index + 1):
-                        version = rc.versions[x]
-                        rc.generate_rule(is_temp, version, old_url, new_url)
-
-            # only one version number provided
-            else:
-                version = match.group(2)
-                if version == "*":
-                    for ver in rc.versions:
-                        rc.generate_rule(is_temp, ver, old_url, new_url)
-                else:
-                    rc.generate_rule(is_temp, version, old_url, new_url)
+            )
 
+    # only one version number provided
+    if rule.last is None:
+        return versions if rule.first == "*" else [rule.first]
+
+    if (rule.opening == "(" and rule.first == "*") or (
+        rule.last == "*" and rule.closing == ")"
+    ):
+        # this should throw an error based on the spec
+        raise ValueError("ERROR: Bad formatting in line " + str(rule.line_num))
+
+    if rule.first == "*":
+        # [* - *] should be a raw redirect
+        if rule.last == "*":
+            raise ValueError("ERROR: Bad formatting in line " + str(rule.line_num))
+        begin_index = 0
+    else:
+        begin_index = positions[rule.first]
+        if rule.opening == "(":
+            begin_index += 1
 
-def parse_source_file(source_path: str, output: Optional[str]) -> bool:
+    if rule.last == "*":
+        end_index = len(versions)
+    else:
+        end_index = positions[rule.last]
+        if rule.closing == "]":
+            end_index += 1
+        # (v2.0 - v2.0) ERROR: make sure we are actually including at least
+        # one version
+        elif rule.opening == "(" and begin_index == end_index + 1:
+            raise ValueError(
+                "ERROR: No versions included in line " + str(rule.line_num)
+            )
+
+    return versions[begin_index:end_index]
+
+
+def run_statement(statement: Statement, rc: RedirectContext) -> None:
+    if isinstance(statement, Define):
+        rc.add_definition(statement.key, rc.expand(statement.value))
+
+    elif isinstance(statement, Symlink):
+        if rc.root is not None:
+            alias, origin = statement.links
+            update_symlink(rc.root, alias, origin)
+            rc.add_symlink(alias, origin)
+
+    elif isinstance(statement, RawRule):
+        rc.generate_rule(False, "raw", statement.old_url, statement.new_url)
+
+    else:
+        for version in select_versions(statement, rc):
+            rc.generate_rule(
+                statement.is_temp, version, statement.old_url, statement.new_url
+            )
+
+
+def update_symlink(root: str, alias: str, origin: str) -> None:
+    """Point the alias in root at origin, unless it already does."""
+    alias_path = os.path.join(root, alias)
+    with contextlib.suppress(OSError):
+        if os.readlink(alias_path) == origin:
+            return
+
+    try:
+        os.remove(alias_path)
+    except FileNotFoundError:
+        pass
+
+    os.symlink(origin, alias_path)
+    metrics.count("symlinks updated")
+
+
+def remove_unknown_symlinks(root: str, aliases: Set[str]) -> None:
+    """Remove the symlinks in root which are not among the given aliases."""
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name in aliases or not os.path.islink(path):
+            continue
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def parse_line(line: str, rc: RedirectContext, line_num: int) -> None:
+    statement = compile_line(line, line_num)
+    if statement is not None:
+        run_statement(statement, rc)
+
+
+def parse_source_file(
+    source_path: str,
+    output: Optional[str],
+    collapse_chains: bool = False,
+    base_url: Optional[str] = None,
+    output_format: str = "htaccess",
+    sort: bool = False,
+    force: bool = False,
+    validate_against: Optional[str] = None,
+) -> bool:
     have_error = False
-    version_regex = re.compile(r"([\[\(])([\w.\*]+)(?:-([\w.\*]+))?([\]\)](.))")
-    url_regex = re.compile(r":(?:[ \t\f\v])(.*)(?:[ \t\f\v]->)(.*)")
 
     root = None
+    digest = None
     if output is not None:
         root = os.path.dirname(output) or "./"
-
-    rc = RedirectContext(root)
-    with open(source_path) as file:
+        digest = state.fingerprint(
+            source_path,
+            {
+                "collapse_chains": collapse_chains,
+                "base_url": base_url,
+                "format": output_format,
+                "sort": sort,
+            },
+        )
+
+        # The output is up to date, but make sure its symlinks are too. The
+        # build tree isn't fingerprinted, so validation always runs.
+        symlinks = None
+        if not force and validate_against is None:
+            symlinks = state.load_unchanged(output, digest)
+        if symlinks is not None:
+            for alias, origin in symlinks:
+                update_symlink(root, alias, origin)
+            remove_unknown_symlinks(root, {alias for alias, _ in symlinks})
+            metrics.count("unchanged outputs")
+            return False
+
+    validator = None
+    if validate_against is not None:
+        with metrics.span("index build"):
+            validator = TargetValidator(TargetIndex(validate_against), base_url)
+
+    with metrics.span("parse"), open(source_path) as file, open_output(output) as f:
+        writer = WRITERS[output_format](f)
+        if validator is not None:
+            writer.validate = validator.check
+        # Rules are written as they are generated, unless chains are to be
+        # collapsed or the rules sorted once every rule is known
+        collect = collapse_chains or sort
+        rc = RedirectContext(root, None if collect else writer)
         for line_num, line in enumerate(file, start=1):
             if not line or line.startswith("#"):
                 continue
 
             try:
-                parse_line(line, rc, line_num, version_regex, url_regex)
+                parse_line(line, rc, line_num)
             except ValueError as err:
                 have_error = True
+                metrics.count("errors")
                 print(f"{line_num}: {str(err)}", file=sys.stderr)
 
-    # Remove unknown symlinks
-    if root is not None:
-        for path in os.listdir(root):
-            if not os.path.islink(path):
-                continue
-
-            if os.path.basename(path) in rc.symlinks:
-                continue
-
-            try:
-                os.remove(path)
-            except FileNotFoundError:
-                pass
+        if root is not None:
+            remove_unknown_symlinks(root, {alias for alias, _ in rc.symlinks})
+
+        if collapse_chains:
+            with metrics.span("collapse"):
+                result = chains.collapse_chains(rc.rules, base_url)
+
+            rc.rules = result.rules
+            metrics.count("redirects collapsed", result.collapsed)
+            metrics.count("hops removed", result.hops_removed)
+            metrics.count("redirect cycles", len(result.cycles))
+            print(
+                f"Collapsed {result.collapsed} redirects, removing "
+                f"{result.hops_removed} hops",
+                file=sys.stderr,
+            )
+            for cycle in result.cycles:
+                have_error = True
+                print(f"Redirect cycle: {' -> '.join(cycle)}", file=sys.stderr)
+
+        if sort:
+            rc.rules.sort(key=lambda rule: split_redirect_key(rule.old_url)[0])
+
+        for rule in rc.rules:
+            writer.write(rule)
+
+    metrics.count("rules", writer.written)
+    metrics.count("duplicate rules", writer.duplicates)
+    metrics.count("conflicting sources", len(writer.conflicts))
+    for old_url, redirects in writer.conflicts.items():
+        targets = ", ".join(
+            "{} {}".format(302 if is_temp else 301, new_url)
+            for is_temp, new_url in redirects
+        )
+        print(f"Conflicting redirects for {old_url}: {targets}", file=sys.stderr)
+
+    if validator is not None:
+        missing = validator.finish(rc.symlinks)
+        metrics.count("missing targets", len(missing))
+        for new_url, old_url in missing.items():
+            print(
+                f"Redirect target not found in {validate_against}: {new_url} "
+                f"(from {old_url})",
+                file=sys.stderr,
+            )
 
-    # Write all our rules to the file
-    if output is None:
-        write_to_file(rc.rules, sys.stdout)
-    else:
-        with open(output, "w") as f:
-            write_to_file(rc.rules, f)
+    # Errors are reported again until they are fixed
+    if output is not None and digest is not None and not have_error:
+        state.save(output, digest, rc.symlinks)
 
     return have_error
 
 
 def main() -> None:
     """Main entry point for mut redirects to create .htaccess file."""
+    # Batch workers re-run the frozen binary, which must hand them over to
+    # multiprocessing rather than running main() again
+    multiprocessing.freeze_support()
     options = docopt(__doc__)
     source_path = options["<source_path>"]
     output = options["--output"]
+    output_format = options["--format"]
+    if output_format not in WRITERS:
+        print(
+            "Unknown format: {}. Choose one of: {}".format(
+                output_format, ", ".join(WRITERS)
+            ),
+            file=sys.stderr,
+        )
+        sys.exit(1)
 
     # Parse source_path and write to file
-    if parse_source_file(source_path, output):
+    with metrics.instrument(
+        "mut-redirects", options["--metrics-file"], options["--profile"]
+    ):
+        if options["batch"]:
+            main_batch(options)
+        elif parse_source_file(
+            source_path,
+            output,
+            options["--collapse-chains"],
+            options["--base-url"],
+            output_format,
+            options["--sort"],
+            options["--force"],
+            options["--validate-against"],
+        ):
+            sys.exit(1)
+
+
+def main_batch(options: Dict[str, Any]) -> None:
+    """Run every job in a job file, or for every source matching a glob."""
+    from mut.redirects.batch import glob_jobs, load_jobs, print_results, run_batch
+
+    try:
+        if options["--glob"]:
+            jobs = glob_jobs(options["--glob"], options["--output-name"])
+        else:
+            jobs = load_jobs(options["<jobfile>"])
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+
+    results = run_batch(
+        jobs,
+        n_workers=int(options["--jobs"]) if options["--jobs"] else None,
+        output_format=options["--format"],
+        sort=options["--sort"],
+        collapse_chains=options["--collapse-chains"],
+        base_url=options["--base-url"],
+        force=options["--force"],
+    )
+    print_results(results)
+    if any(result.have_error for result in results):
         sys.exit(1)
 
 
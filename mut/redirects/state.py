@@ -0,0 +1,74 @@
+"""A record of each mut-redirects run, kept beside its output, so that a run
+whose inputs are unchanged can leave the output and its symlinks alone.
+
+The record is a hidden JSON file: .htaccess.fingerprint for .htaccess. It
+holds a fingerprint of the source file, the options and the mut version, the
+size and modification time the output was left with, and the symlinks that
+were created.
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from mut import __version__
+
+
+def state_path(output: str) -> str:
+    directory, name = os.path.split(output)
+    if not name.startswith("."):
+        name = "." + name
+
+    return os.path.join(directory, name + ".fingerprint")
+
+
+def fingerprint(source_path: str, options: Dict[str, Any]) -> str:
+    """Hash a source file together with the options used to generate its
+    output."""
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps([__version__, options], sort_keys=True).encode())
+    with open(source_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+
+def _output_stat(output: str) -> Optional[List[int]]:
+    try:
+        stat = os.stat(output)
+    except FileNotFoundError:
+        return None
+
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_unchanged(output: str, digest: str) -> Optional[List[Tuple[str, str]]]:
+    """If output was generated from inputs with the given fingerprint, and has
+    not been modified since, return the (alias, origin) symlinks recorded for
+    it. Otherwise, return None."""
+    try:
+        with open(state_path(output), "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(state, dict) or state.get("fingerprint") != digest:
+        return None
+
+    if state.get("output") != _output_stat(output):
+        return None
+
+    return [(str(alias), str(origin)) for alias, origin in state["symlinks"]]
+
+
+def save(output: str, digest: str, symlinks: List[Tuple[str, str]]) -> None:
+    """Record a successful run, once its output has been written."""
+    state = {
+        "fingerprint": digest,
+        "output": _output_stat(output),
+        "symlinks": symlinks,
+    }
+    with open(state_path(output), "w") as f:
+        json.dump(state, f)
@@ -0,0 +1,93 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from mut.redirects.batch import glob_jobs, load_jobs, print_results, run_batch
+
+ROOT = Path(__file__).parent
+
+
+def test_run_batch(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    for name in ("ruby", "spark"):
+        (tmp_path / name).mkdir()
+    shutil.copy(ROOT / "ruby" / "ruby-redirects.txt", tmp_path / "ruby" / "redirects")
+    shutil.copy(
+        ROOT / "spark" / "spark-redirects-input.txt", tmp_path / "spark" / "redirects"
+    )
+    (tmp_path / "broken").mkdir()
+    (tmp_path / "broken" / "redirects").write_text(
+        "define: versions v1 v2\n[v1-v3]: /a -> /b\n(v1-v1): /a -> /b\n"
+    )
+    jobfile = tmp_path / "jobs.yaml"
+    jobfile.write_text(
+        "source: ruby/redirects\noutput: ruby/.htaccess\n"
+        "---\n"
+        "source: spark/redirects\noutput: spark/.htaccess\n"
+        "base_url: https://docs.mongodb.com/spark-connector\n"
+        "---\n"
+        "source: missing/redirects\noutput: missing/.htaccess\n"
+    )
+    monkeypatch.chdir(tmp_path)
+
+    jobs = load_jobs(str(jobfile))
+    assert [job.base_url for job in jobs] == [
+        None,
+        "https://docs.mongodb.com/spark-connector",
+        None,
+    ]
+    results = run_batch(jobs, n_workers=2)
+    assert [result.have_error for result in results] == [False, False, True]
+    assert (tmp_path / "ruby" / ".htaccess").read_text() == (
+        ROOT / "ruby" / "ruby_expected.txt"
+    ).read_text()
+    assert (tmp_path / "spark" / ".htaccess").read_text() == (
+        ROOT / "spark" / "spark_expected.txt"
+    ).read_text()
+
+    jobs = glob_jobs("**/redirects", ".htaccess")
+    assert [job.output for job in jobs] == [
+        "broken/.htaccess",
+        "ruby/.htaccess",
+        "spark/.htaccess",
+    ]
+    results = run_batch(jobs, n_workers=2)
+    assert [result.have_error for result in results] == [True, False, False]
+    capsys.readouterr()
+
+    # Errors from every job are reported together, labelled with their source
+    print_results(results)
+    assert capsys.readouterr().err.splitlines() == [
+        "broken/redirects: 2: ERROR in line 2: Version v3 not present in version list",
+        "broken/redirects: 3: ERROR: No versions included in line 3",
+    ]
+
+
+def test_load_jobs(tmp_path: Path) -> None:
+    jobfile = tmp_path / "jobs.yaml"
+    jobfile.write_text("source: a\n")
+    with pytest.raises(ValueError):
+        load_jobs(str(jobfile))
+
+    # Jobs sharing an output would overwrite each other
+    jobfile.write_text(
+        "source: a\noutput: build/.htaccess\n---\n"
+        "source: b\noutput: build/../build/.htaccess\n"
+    )
+    with pytest.raises(ValueError, match="Both a and b"):
+        load_jobs(str(jobfile))
+
+
+def test_glob_jobs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "conf").mkdir()
+    for name in ("one", "two"):
+        (tmp_path / "conf" / name).write_text("")
+
+    with pytest.raises(ValueError, match="conf/.htaccess"):
+        glob_jobs("conf/*", ".htaccess")
+    assert [job.output for job in glob_jobs("conf/one", ".htaccess")] == [
+        "conf/.htaccess"
+    ]
@@ -0,0 +1,98 @@
+from pathlib import Path
+
+import pytest
+
+from mut.redirects.chains import SourceMatcher, collapse_chains
+from mut.redirects.redirect_main import RuleDefinition, parse_source_file
+
+
+def rule(old_url: str, new_url: str, is_temp: bool = False) -> RuleDefinition:
+    return RuleDefinition(is_temp, "raw", old_url, new_url, False)
+
+
+def test_collapse_chains() -> None:
+    result = collapse_chains(
+        [
+            rule("/a", "/docs/x/b"),
+            rule("/b", "https://www.mongodb.com/docs/x/c", is_temp=True),
+            rule("/c", "/docs/x/d"),
+            rule("/d", "https://www.mongodb.com/docs/y/d"),
+            # Sources with conflicting targets are not followed
+            rule("/e", "/docs/x/f"),
+            rule("/f", "/docs/x/a"),
+            rule("/f", "/docs/x/b"),
+        ],
+        "https://www.mongodb.com/docs/x/",
+    )
+    final = "https://www.mongodb.com/docs/y/d"
+    assert [(r.old_url, r.new_url, r.is_temp) for r in result.rules] == [
+        ("/a", final, True),
+        ("/b", final, True),
+        ("/c", final, False),
+        ("/d", final, False),
+        ("/e", "/docs/x/f", False),
+        ("/f", final, True),
+        ("/f", final, True),
+    ]
+    assert (result.collapsed, result.hops_removed, result.cycles) == (5, 13, [])
+
+    # Targets in sibling properties are not sources, however long their path
+    base_url = "https://www.mongodb.com/docs/manual"
+    match_source = SourceMatcher(base_url)
+    assert match_source("/docs/atlas1/foo") is None
+    assert match_source("/docs/manual2/foo") is None
+    assert match_source("https://www.mongodb.com/docs/manualx/foo") is None
+    assert match_source("/docs/manual") == "/"
+    assert match_source("/docs/manual/foo") == "/foo"
+    assert match_source(base_url + "/foo") == "/foo"
+    result = collapse_chains(
+        [rule("/x", "/docs/atlas1/a"), rule("/a", "https://elsewhere.com/z")],
+        base_url,
+    )
+    assert result.rules[0].new_url == "/docs/atlas1/a"
+    assert result.collapsed == 0
+
+    # Without a base URL, only absolute paths are followed
+    result = collapse_chains([rule("/a", "/b"), rule("/b", "https://x.com/c")])
+    assert result.rules[0].new_url == "https://x.com/c"
+    result = collapse_chains([rule("/a", "https://x.com/b"), rule("/b", "/c")])
+    assert result.collapsed == 0
+
+
+def test_cycles(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    result = collapse_chains(
+        [
+            rule("/a", "/b"),
+            rule("/b", "/c"),
+            rule("/c", "/b"),
+            rule("/d", "/d"),
+            rule("/e", "/f"),
+        ]
+    )
+    assert result.rules[:4] == [
+        rule("/a", "/b"),
+        rule("/b", "/c"),
+        rule("/c", "/b"),
+        rule("/d", "/d"),
+    ]
+    assert result.cycles == [["/b", "/c", "/b"], ["/d", "/d"]]
+
+    source = tmp_path / "redirects"
+    source.write_text(
+        "raw: /a -> /b\n"
+        "raw: /b -> /a\n"
+        "raw: /c -> /d\n"
+        "raw: /d -> https://www.mongodb.com/\n"
+    )
+    assert parse_source_file(str(source), None, collapse_chains=True)
+    out, err = capsys.readouterr()
+    assert out.splitlines() == [
+        "Redirect 301 /a /b",
+        "Redirect 301 /b /a",
+        "Redirect 301 /c https://www.mongodb.com/",
+        "Redirect 301 /d https://www.mongodb.com/",
+    ]
+    assert err.splitlines() == [
+        "Collapsed 1 redirects, removing 1 hops",
+        "Redirect cycle: /b -> /a -> /b",
+    ]
@@ -0,0 +1,342 @@
+import io
+import os
+import urllib.parse
+from pathlib import Path
+from typing import Tuple
+
+import pytest
+
+from mut.redirects.redirect_main import (
+    HtaccessWriter,
+    RedirectContext,
+    RuleDefinition,
+    Template,
+    is_valid_target,
+    parse_source_file,
+)
+from mut.stage import DeployStaging, Staging, read_redirects, translate_htaccess
+
+ROOT = Path(__file__).parent
+
+
+def test_fixtures(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    assert not parse_source_file(str(ROOT / "ruby" / "ruby-redirects.txt"), None)
+    expected = (ROOT / "ruby" / "ruby_expected.txt").read_text()
+    assert capsys.readouterr().out == expected
+
+    # Symlinked versions get their own copies of each rule
+    monkeypatch.chdir(tmp_path)
+    output = tmp_path / ".htaccess"
+    source = ROOT / "spark" / "spark-redirects-input.txt"
+    assert not parse_source_file(str(source), str(output))
+    expected = (ROOT / "spark" / "spark_expected.txt").read_text()
+    assert output.read_text() == expected
+
+
+def test_errors(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    source = tmp_path / "redirects"
+    source.write_text(
+        "define: versions v1 v2 v3\n"
+        "(v2-v2): /a -> /b\n"
+        "[*-*]: /a -> /b\n"
+        "[v1-v9]: /a -> /b\n"
+        "[v2] /a -> /b\n"
+        "[v1-v2]: /${version}/a -> relative\n"
+        "(v1-*]: /${version}/ok -> /${version}/ok\n"
+    )
+    assert parse_source_file(str(source), None)
+    out, err = capsys.readouterr()
+    assert out == "Redirect 301 /v2/ok /v2/ok\nRedirect 301 /v3/ok /v3/ok\n"
+    assert err.splitlines() == [
+        "2: ERROR: No versions included in line 2",
+        "3: ERROR: Bad formatting in line 3",
+        "4: ERROR in line 4: Version v9 not present in version list",
+        "5: ERROR in line 5: Bad rule syntax",
+        "6: Invalid redirect target: 'relative'. Redirect targets must be absolute HTTP URLs.",
+    ]
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "",
+        "  /${version}/a  ",
+        "${base}${version}${prefix}",
+        "/{prefix}/${prefix}",
+        "${dollar}{prefix}",
+        "/a${brace}/${version}",
+        "${a${version}",
+    ],
+)
+@pytest.mark.parametrize("version", ["", "v1", " v1", "v$"])
+def test_template(source: str, version: str) -> None:
+    rc = RedirectContext(None)
+    rc.add_definition("base", " https://example.com ")
+    rc.add_definition("prefix", "docs")
+    rc.add_definition("dollar", "$")
+    rc.add_definition("brace", "{version}")
+    try:
+        expected = rc.rule_substitute(source, version)
+    except KeyError:
+        with pytest.raises(KeyError):
+            rc.expand(Template(source), version)
+    else:
+        assert rc.expand(Template(source), version) == expected
+
+
+def test_symlink_chains(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    source = tmp_path / "redirects"
+    source.write_text(
+        "define: versions v1 v2 master\n"
+        "symlink: current -> master\n"
+        "symlink: stable -> current\n"
+        "symlink: upcoming -> master\n"
+        "[v2-*]: /${version}/a -> /${version}/b\n"
+    )
+    output = tmp_path / ".htaccess"
+    assert not parse_source_file(str(source), str(output))
+    assert [line.split()[2] for line in output.read_text().splitlines()] == [
+        "/v2/a",
+        "/stable/a",
+        "/current/a",
+        "/upcoming/a",
+        "/master/a",
+    ]
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/",
+        "/a/b",
+        "//host/a",
+        "/\t/host",
+        "https://www.mongodb.com/docs",
+        "http://[::1",
+        "HTTPS://www.mongodb.com",
+        "https://exa\uff0fmple.com",
+        "ftp://example.com",
+        "relative/a",
+        "",
+    ],
+)
+def test_is_valid_target(url: str) -> None:
+    try:
+        parsed = urllib.parse.urlparse(url)
+    except ValueError:
+        with pytest.raises(ValueError):
+            is_valid_target(url)
+    else:
+        expected = parsed.scheme in {"http", "https"} or parsed.path.startswith("/")
+        assert is_valid_target(url) == expected
+
+
+def test_writer() -> None:
+    f = io.StringIO()
+    writer = HtaccessWriter(f)
+    for old_url, new_url in [
+        ("/a", "/x"),
+        ("/a", "/x"),
+        ("/b", "/z"),
+        ("/a", "/x"),
+        ("/a", "/y"),
+        ("/a", "/x"),
+    ]:
+        writer.write(RuleDefinition(False, "v1", old_url, new_url, False))
+    writer.write(RuleDefinition(True, "v1", "/b", "/z", False))
+
+    # Only repeats of the current redirect for a source are dropped, so the
+    # first and the last redirects for each are unchanged
+    assert f.getvalue().splitlines() == [
+        "Redirect 301 /a /x",
+        "Redirect 301 /b /z",
+        "Redirect 301 /a /y",
+        "Redirect 301 /a /x",
+        "Redirect 302 /b /z",
+    ]
+    assert (writer.written, writer.duplicates) == (5, 2)
+    assert writer.conflicts == {
+        "/a": [(False, "/x"), (False, "/y")],
+        "/b": [(False, "/z"), (True, "/z")],
+    }
+
+
+def test_output(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    source = tmp_path / "redirects"
+    source.write_text(
+        "define: versions v1 v2\n"
+        "[*]: /${version}/a -> /${version}/b\n"
+        "[v2]: /${version}/a -> /${version}/b\n"
+        "[v2]: /${version}/a -> /${version}/c\n"
+    )
+    output = tmp_path / ".htaccess"
+    assert not parse_source_file(str(source), str(output))
+    assert output.read_text().splitlines() == [
+        "Redirect 301 /v1/a /v1/b",
+        "Redirect 301 /v2/a /v2/b",
+        "Redirect 301 /v2/a /v2/c",
+    ]
+    assert capsys.readouterr().err == (
+        "Conflicting redirects for /v2/a: 301 /v2/b, 301 /v2/c\n"
+    )
+
+    # An existing file is left alone if generating its replacement fails
+    source.write_text("define: versions v1 v2\n[*]: /${undefined} -> /a\n")
+    with pytest.raises(KeyError):
+        parse_source_file(str(source), str(output))
+    assert len(output.read_text().splitlines()) == 3
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        ".htaccess",
+        ".htaccess.fingerprint",
+        "redirects",
+    ]
+
+
+def test_incremental(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    source = tmp_path / "redirects"
+    source.write_text(
+        "define: versions v1 v2\n"
+        "symlink: current -> v2\n"
+        "[*]: /${version}/a -> /${version}/b\n"
+    )
+    output = tmp_path / ".htaccess"
+    link = tmp_path / "current"
+    (tmp_path / "stale").symlink_to("v1")
+
+    def mtimes() -> Tuple[int, int]:
+        return output.stat().st_mtime_ns, link.lstat().st_mtime_ns
+
+    assert not parse_source_file(str(source), str(output))
+    assert os.readlink(link) == "v2"
+    assert not (tmp_path / "stale").is_symlink()
+    before = mtimes()
+
+    # Unchanged inputs touch neither the output nor its symlinks, even when
+    # regeneration is forced
+    assert not parse_source_file(str(source), str(output))
+    assert not parse_source_file(str(source), str(output), force=True)
+    assert mtimes() == before
+
+    # ...but symlinks are still repaired
+    link.unlink()
+    link.symlink_to("v1")
+    (tmp_path / "stale").symlink_to("v1")
+    assert not parse_source_file(str(source), str(output))
+    assert os.readlink(link) == "v2"
+    assert not (tmp_path / "stale").is_symlink()
+    assert output.stat().st_mtime_ns == before[0]
+
+    # Changing the source or the options regenerates the output
+    source.write_text(
+        "define: versions v1 v2\n"
+        "symlink: current -> v1\n"
+        "[*]: /${version}/a -> /${version}/c\n"
+    )
+    assert not parse_source_file(str(source), str(output))
+    assert os.readlink(link) == "v1"
+    assert output.read_text().splitlines() == [
+        "Redirect 301 /current/a /current/c",
+        "Redirect 301 /v1/a /v1/c",
+        "Redirect 301 /v2/a /v2/c",
+    ]
+    assert not parse_source_file(str(source), str(output), sort=True)
+    assert output.read_text().splitlines() == [
+        "Redirect 301 /current/a /current/c",
+        "Redirect 301 /v1/a /v1/c",
+        "Redirect 301 /v2/a /v2/c",
+    ]
+
+    # As does editing the output
+    output.write_text("")
+    assert not parse_source_file(str(source), str(output), sort=True)
+    assert len(output.read_text().splitlines()) == 3
+
+
+def test_table(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    source = ROOT / "ruby" / "ruby-redirects.txt"
+    htaccess = tmp_path / ".htaccess"
+    table = tmp_path / "redirects.tsv"
+    assert not parse_source_file(str(source), str(htaccess))
+    assert not parse_source_file(
+        str(source), str(table), output_format="table", sort=True
+    )
+
+    rows = table.read_text().splitlines()
+    assert rows[0].split("\t") == ["key", "page", "status", "target", "source"]
+    keys = [row.split("\t")[0] for row in rows[1:]]
+    assert keys == sorted(keys)
+
+    # mut-publish reads the same redirects from either format
+    for staging in (Staging, DeployStaging):
+        expected = {
+            staging.normalize_key(src): dest
+            for src, dest in translate_htaccess(str(htaccess))
+        }
+        assert {
+            staging.page_key(key, is_page): dest
+            for key, is_page, dest in read_redirects(str(table))
+        } == expected
+
+    # The root page redirects from the bucket's index, in either format, and
+    # its key is unchanged by normalizing it again
+    source = tmp_path / "root"
+    source.write_text("raw: / -> https://www.mongodb.com/docs/\n")
+    assert not parse_source_file(str(source), str(htaccess), force=True)
+    assert not parse_source_file(str(source), str(table), output_format="table")
+    for staging, key in ((Staging, ""), (DeployStaging, "index.html")):
+        for path in (htaccess, table):
+            assert [
+                staging.page_key(page, is_page)
+                for page, is_page, _ in read_redirects(str(path))
+            ] == [key]
+        assert staging.normalize_key("/") == key
+        assert staging.normalize_key(key) == key
+
+
+def test_validate_against(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    build = tmp_path / "build"
+    for path in ("v1/a", "v2/b", "v2/c%d"):
+        (build / path).mkdir(parents=True)
+        (build / path / "index.html").write_text("")
+    (build / "v2" / "page.html").write_text("")
+    (build / "current").symlink_to("v2")
+
+    monkeypatch.chdir(tmp_path)
+    source = tmp_path / "redirects"
+    source.write_text(
+        "define: versions v1 v2\n"
+        "symlink: stable -> v1\n"
+        "[*]: /${version}/x -> /docs/${version}/a/\n"
+        "raw: /y -> /docs/current/page.html#section\n"
+        "raw: /z -> https://www.mongodb.com/docs/stable/a/index.html\n"
+        "raw: /w -> https://www.mongodb.com/docs/v2/c%25d?q=1\n"
+        "raw: /u -> https://example.com/missing\n"
+        "raw: /t -> /docs/current/missing\n"
+        # Targets in sibling properties aren't in this build
+        "raw: /s -> /dox1/v1/a/\n"
+        "raw: /r -> /dox2/missing\n"
+        "raw: /q -> https://www.mongodb.com/docs2/missing\n"
+    )
+    output = tmp_path / "out" / ".htaccess"
+    output.parent.mkdir()
+    assert not parse_source_file(
+        str(source),
+        str(output),
+        base_url="https://www.mongodb.com/docs",
+        validate_against=str(build),
+    )
+    # stable is only defined in the source, as the output is elsewhere
+    assert capsys.readouterr().err.splitlines() == [
+        f"Redirect target not found in {build}: /docs/v2/a/ (from /v2/x)",
+        f"Redirect target not found in {build}: /docs/current/missing (from /t)",
+    ]
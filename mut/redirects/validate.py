@@ -0,0 +1,114 @@
+"""Check that redirect targets exist in a built site."""
+
+import os
+import urllib.parse
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Set, Tuple
+
+from mut.redirects.chains import SourceMatcher
+
+if TYPE_CHECKING:
+    from mut.redirects.redirect_main import RuleDefinition
+
+# Give up resolving a path after following this many symlinks
+MAX_ALIAS_HOPS = 40
+
+
+class TargetIndex:
+    """The path of every file and directory in a build tree, relative to its
+    root, with symlinks kept as aliases of the paths they point to rather
+    than followed, so that each version directory is only scanned once."""
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.paths = set()  # type: Set[str]
+        self.aliases = {}  # type: Dict[str, str]
+        self._scan()
+
+    def _scan(self) -> None:
+        real_root = os.path.realpath(self.root)
+        stack = [("", self.root)]
+        while stack:
+            rel_dir, directory = stack.pop()
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    path = rel_dir + "/" + entry.name
+                    if entry.is_symlink():
+                        target = os.path.realpath(entry.path)
+                        if os.path.commonpath((real_root, target)) == real_root:
+                            rel_target = os.path.relpath(target, real_root)
+                            self.aliases[path] = (
+                                "" if rel_target == "." else "/" + rel_target
+                            )
+                        elif os.path.exists(target):
+                            self.paths.add(path)
+                        continue
+
+                    self.paths.add(path)
+                    if entry.is_dir():
+                        stack.append((path, entry.path))
+
+    def add_aliases(self, symlinks: Iterable[Tuple[str, str]]) -> None:
+        """Add (alias, origin) symlinks defined relative to the root which do
+        not exist in the tree."""
+        for alias, origin in symlinks:
+            path = "/" + alias.strip("/")
+            if path not in self.paths and path not in self.aliases:
+                self.aliases[path] = "/" + origin.strip("/")
+
+    def __contains__(self, path: str) -> bool:
+        path = path.rstrip("/")
+        for _ in range(MAX_ALIAS_HOPS):
+            if not path or path in self.paths:
+                return True
+
+            # Replace the longest prefix which is a symlink with its target
+            prefix = path
+            while prefix and prefix not in self.aliases:
+                prefix = prefix[: prefix.rfind("/")]
+            if not prefix:
+                return False
+            path = self.aliases[prefix] + path[len(prefix) :]
+
+        return False
+
+
+class TargetValidator:
+    """Collects redirects whose targets are on the site, but missing from
+    its build tree. Path targets, and with a base URL, absolute URLs under
+    it, are checked."""
+
+    def __init__(self, index: TargetIndex, base_url: Optional[str] = None) -> None:
+        self.index = index
+        self.match_target = SourceMatcher(base_url)
+        # The first source redirected to each missing target
+        self.missing = {}  # type: Dict[str, str]
+        self._found = set()  # type: Set[str]
+
+    def _target_path(self, url: str) -> Optional[str]:
+        path = self.match_target(url)
+        if path is None:
+            return None
+
+        return urllib.parse.unquote(path.split("#", 1)[0].split("?", 1)[0])
+
+    def check(self, rule: "RuleDefinition") -> None:
+        if rule.new_url in self._found or rule.new_url in self.missing:
+            return
+
+        path = self._target_path(rule.new_url)
+        if path is not None and path not in self.index:
+            self.missing[rule.new_url] = rule.old_url
+        else:
+            self._found.add(rule.new_url)
+
+    def finish(self, symlinks: Iterable[Tuple[str, str]]) -> Dict[str, str]:
+        """Return the missing targets, and the first source redirected to
+        each, once the given symlinks are taken into account. They may not
+        have been created in the build tree."""
+        self.index.add_aliases(symlinks)
+        for target in list(self.missing):
+            path = self._target_path(target)
+            if path is not None and path in self.index:
+                del self.missing[target]
+
+        return self.missing
@@ -20,6 +20,7 @@
                       [--redirect-prefix=prefix]...
                       [--dry-run] [--verbose] [--json]
                       [--force-sync-redirects]
+                      [--metrics-file=path] [--profile=path]
 mut-publish --version
 
 -h --help                       show this help message
@@ -32,7 +33,9 @@ mut-publish --version
                                 files, as well as the subdirectory given by the current
                                 git branch.
 
---redirects=htaccess            use the redirects from the given .htaccess file
+--redirects=htaccess            use the redirects from the given .htaccess file, or
+                                from the table written by
+                                mut-redirects --format=table
 
 --redirect-prefix=<re>          regular expression specifying a prefix under which
                                 mut-publish may remove redirects. You may provide this
@@ -45,6 +48,10 @@ mut-publish --version
 --verbose                       print more verbose debugging information
 --version                       show mut version
 --force-sync-redirects          force mut to sync redirects to S3 regardless of current branch
+--metrics-file=path             write timings and counters for the run to the given
+                                path as json
+--profile=path                  run under cProfile, writing the statistics to the
+                                given path
 
 Environment Variables:
 MUT_CACHE_CONTROL               A value for the Cache-Control header to be attached to
@@ -67,12 +74,10 @@ import re
 import sys
 import time
 
-import boto3
-import boto3.s3.transfer
-import botocore
 import docopt
 
 from . import AuthenticationInfo
+from . import metrics
 from . import util
 
 from typing import (
@@ -145,6 +150,7 @@ class Timer:
         old_time = self.time
         self.time = time.perf_counter()
         logger.info("%s: %s: %ss", self.name, name, self.time - old_time)
+        metrics.record("{}: {}".format(self.name, name), self.time - old_time)
 
 
 class StagingException(Exception):
@@ -214,6 +220,7 @@ def run_pool(
     if retries == 0:
         raise SyncException([result[1] for result in results])
 
+    metrics.count("retries", len(results))
     run_pool([r[0] for r in results], n_workers, retries - 1)
 
 
@@ -263,6 +270,10 @@ class ChangeSet:
         self.commands_redirect = []  # type: List[Tuple[str, str]]
         self.commands_upload = []  # type: List[Tuple[str, str, str]]
 
+        # boto3 takes a noticeable fraction of a second to import, so it is
+        # only loaded once a run needs s3.
+        import boto3.s3.transfer
+
         self.s3_config = boto3.s3.transfer.TransferConfig(
             multipart_threshold=UPLOAD_CHUNK_SIZE, multipart_chunksize=UPLOAD_CHUNK_SIZE
         )
@@ -373,9 +384,12 @@ class ChangeSet:
             if not objects:
                 continue
             s3.delete_objects(Delete={"Objects": objects, "Quiet": True})
+            metrics.count("requests")
 
     def __upload(self, s3: Any, src_path: str, key: str) -> None:
         """Thread worker helper to handle uploading a single file to S3."""
+        import botocore.exceptions
+
         # Deduce a mimetype and content encoding
         guessed_type, guessed_content_encoding = mimetypes.guess_type(src_path)
         if guessed_type:
@@ -393,6 +407,8 @@ class ChangeSet:
                 ExtraArgs={"CacheControl": self.cache_control[key], **mimetype_headers},
                 Config=self.s3_config,
             )
+            metrics.count("files uploaded")
+            metrics.count("bytes uploaded", os.path.getsize(src_path))
             sys.stdout.write(".")
             sys.stdout.flush()
         except botocore.exceptions.ClientError as err:
@@ -402,7 +418,10 @@ class ChangeSet:
 
     def __redirect(self, s3: Any, src: str, dest: str) -> None:
         """Thread worker helper to handle creating a redirect."""
+        import botocore.exceptions
+
         obj = s3.Object(src)
+        metrics.count("requests")
         try:
             if obj.website_redirect_location == dest:
                 logger.debug("Skipping redirect %s", src)
@@ -412,6 +431,8 @@ class ChangeSet:
                 logger.exception("S3 error creating redirect from %s to %s", src, dest)
 
         obj.put(WebsiteRedirectLocation=dest)
+        metrics.count("requests")
+        metrics.count("redirects written")
         sys.stdout.write(".")
         sys.stdout.flush()
 
@@ -427,6 +448,7 @@ def md5_file(path: str) -> str:
             if not data:
                 break
 
+            metrics.count("bytes hashed", len(data))
             hasher = hashlib.md5()
             hasher.update(data)
             parts.append(hasher)
@@ -452,6 +474,26 @@ def translate_htaccess(path: str) -> Iterable[Tuple[str, str]]:
         logger.warn("Failed to open %s", path)
 
 
+def read_redirects(path: str) -> Iterable[Tuple[str, bool, str]]:
+    """Read the redirects from a .htaccess file, or from the table written by
+    mut-redirects --format=table, as (key, is_page, target) tuples. Keys from a
+    table are used as they were written, without parsing them again."""
+    try:
+        with open(path, "r") as f:
+            if f.readline() == util.REDIRECT_TABLE_HEADER:
+                for line in f:
+                    key, page, _, target, _ = line.rstrip("\n").split("\t")
+                    yield (key, page == "1", target)
+                return
+    except IOError:
+        logger.warn("Failed to open %s", path)
+        return
+
+    for src, dest in translate_htaccess(path):
+        key, is_page = util.split_redirect_key(src)
+        yield (key, is_page, dest)
+
+
 class Config:
     """Staging and deployment runtime configuration."""
 
@@ -551,6 +593,7 @@ class StagingCollector:
 
         # List all current redirects
         remote_keys = list(remote_keys)
+        metrics.count("keys listed", len(remote_keys))
         timer.lap("listed")
         logger.info("%d entries", len(remote_keys))
         for key in remote_keys:
@@ -654,6 +697,8 @@ class Staging:
     Collector = StagingCollector
 
     def __init__(self, config: Config) -> None:
+        import boto3.session
+
         self.config = config
 
         auth = config.authentication
@@ -701,8 +746,8 @@ class Staging:
 
         redirects = {}  # type: Dict[str, str]
         if self.config.force_sync_redirects or self.config.branch in PRIMARY_BRANCHES:
-            for src, dest in translate_htaccess(htaccess_path):
-                redirects[self.normalize_key(src)] = dest
+            for key, is_page, dest in read_redirects(htaccess_path):
+                redirects[self.page_key(key, is_page)] = dest
 
         # Ensure that the root ends with a trailing slash to make future
         # manipulations more predictable.
@@ -769,11 +814,17 @@ class Staging:
         pass
 
     @classmethod
-    def normalize_key(cls, key: str) -> str:
-        if os.path.splitext(key)[1] in (".gz", ".pdf", ".epub", ".html"):
-            return key.lstrip("/")
+    def page_key(cls, key: str, is_page: bool) -> str:
+        """Append the bucket's index suffix to a page's key. The root page's
+        key is the suffix alone, so that normalizing a key is idempotent."""
+        if not is_page:
+            return key
 
-        return key.strip("/") + cls.PAGE_SUFFIX
+        return (key + cls.PAGE_SUFFIX).lstrip("/")
+
+    @classmethod
+    def normalize_key(cls, key: str) -> str:
+        return cls.page_key(*util.split_redirect_key(key))
 
 
 class DeployStaging(Staging):
@@ -822,8 +873,9 @@ class DeployStaging(Staging):
 
         self.changes.delete_redirects(removed)
 
-        for src in redirects:
-            self.changes.redirect(self.normalize_key(src), redirects[src])
+        # Keys were normalized as the redirects were read
+        for key, dest in redirects.items():
+            self.changes.redirect(key, dest)
 
 
 def do_stage(root: str, staging: Staging) -> None:
@@ -880,47 +932,52 @@ def main() -> None:
 
     logger.info("Config:", vars(config))
 
-    if mode_stage:
-        staging = Staging(config)
-    elif mode_deploy:
-        staging = DeployStaging(config)
+    with metrics.instrument(
+        "mut-publish", options["--metrics-file"], options["--profile"]
+    ):
+        import botocore.exceptions
 
-    try:
-        do_stage(root, staging)
+        if mode_stage:
+            staging = Staging(config)
+        elif mode_deploy:
+            staging = DeployStaging(config)
 
-        summary = staging.changes.print(return_json)
+        try:
+            do_stage(root, staging)
 
-        if summary.suspicious:
-            (prompt, confirmation) = (
-                util.color("Commit? (y/n): ", ("red", "bright")),
-                "y",
-            )
-        else:
-            (prompt, confirmation) = ("Commit? (y/n): ", "y")
+            summary = staging.changes.print(return_json)
 
-        if not dry_run:
-            if mode_stage:
-                staging.changes.commit(staging.s3)
+            if summary.suspicious:
+                (prompt, confirmation) = (
+                    util.color("Commit? (y/n): ", ("red", "bright")),
+                    "y",
+                )
             else:
-                if input(prompt) == confirmation:
+                (prompt, confirmation) = ("Commit? (y/n): ", "y")
+
+            if not dry_run:
+                if mode_stage:
                     staging.changes.commit(staging.s3)
                 else:
-                    sys.exit(1)
-
-    except botocore.exceptions.ClientError as err:
-        if err.response["ResponseMetadata"]["HTTPStatusCode"] == 403:
-            logger.error("Failed to upload to S3: Permission denied.")
-            logger.info("Check your authentication configuration")
-            return
-
-        raise err
-    except SyncException as err:
-        logger.error("Failed to upload some files:")
-        for sub_err in err.errors:
-            try:
-                raise sub_err from err
-            except SyncFileException as sync_err:
-                logger.error("%s: %s", sync_err.path, sync_err.reason)
+                    if input(prompt) == confirmation:
+                        staging.changes.commit(staging.s3)
+                    else:
+                        sys.exit(1)
+
+        except botocore.exceptions.ClientError as err:
+            if err.response["ResponseMetadata"]["HTTPStatusCode"] == 403:
+                logger.error("Failed to upload to S3: Permission denied.")
+                logger.info("Check your authentication configuration")
+                return
+
+            raise err
+        except SyncException as err:
+            logger.error("Failed to upload some files:")
+            for sub_err in err.errors:
+                try:
+                    raise sub_err from err
+                except SyncFileException as sync_err:
+                    logger.error("%s: %s", sync_err.path, sync_err.reason)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+"""
+Benchmark how long each mut command takes to start, by timing `mut <command>
+--help` in a fresh interpreter. Run with `python -m mut.startup_benchmark`.
+
+Usage:
+    mut.startup_benchmark [-r <repeat>] [--json] [<command>...]
+
+    -h, --help             List CLI prototype, arguments, and options.
+    <command>              Commands to time. Defaults to all of them.
+    -r, --repeat <repeat>  Number of timed runs of each command. The fastest
+                           run is reported. [default: 10]
+    --json                 Print the report as json.
+"""
+
+import statistics
+import subprocess
+import sys
+import time
+from json import dumps
+from typing import Dict, List
+
+from docopt import docopt
+
+from mut.helper import COMMANDS
+
+
+def time_command(args: List[str], repeat: int) -> List[float]:
+    """Return the wall time of each of repeat runs of a python interpreter
+    with the given arguments."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *args],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_benchmark(commands: List[str], repeat: int) -> Dict[str, Dict[str, float]]:
+    """Time the bare interpreter, then each command's help."""
+    runs = {"python": time_command(["-c", "pass"], repeat)}
+    for command in commands:
+        runs[command] = time_command(["-m", "mut.helper", command, "--help"], repeat)
+
+    return {
+        name: {"fastest": min(timings), "median": statistics.median(timings)}
+        for name, timings in runs.items()
+    }
+
+
+def print_report(report: Dict[str, Dict[str, float]]) -> None:
+    baseline = report["python"]["fastest"]
+    justify = max(len(name) for name in report) + 1
+    print("{} {:>9} {:>9} {:>9}".format("".ljust(justify), "fastest", "median", "mut"))
+    for name, timing in report.items():
+        print(
+            "{} {:8.1f}ms {:8.1f}ms {:8.1f}ms".format(
+                (name + ":").ljust(justify),
+                timing["fastest"] * 1000,
+                timing["median"] * 1000,
+                (timing["fastest"] - baseline) * 1000,
+            )
+        )
+
+
+def main() -> None:
+    options = docopt(__doc__)
+    commands = options["<command>"] or list(COMMANDS)
+    unknown = [command for command in commands if command not in COMMANDS]
+    if unknown:
+        print("Unknown command: {}".format(", ".join(unknown)), file=sys.stderr)
+        sys.exit(1)
+
+    report = run_benchmark(commands, max(1, int(options["--repeat"])))
+    if options["--json"]:
+        print(dumps(report, indent=4))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
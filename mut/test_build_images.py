@@ -0,0 +1,187 @@
+import logging
+import os
+import stat
+import sys
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from mut import build_images
+
+# Stand-ins for inkscape and svgo, which log how they are run, and prefix the
+# files they write with "baked" and "minified"
+INKSCAPE = """
+import os, sys
+with open(os.environ["MUT_TEST_LOG"], "a") as log:
+    log.write("inkscape " + " ".join(sys.argv[1:]) + "\\n")
+
+if sys.argv[1:] == ["--version"]:
+    print("Inkscape 1.2.2 (test)")
+    sys.exit(0)
+
+def bake(source, destination):
+    if "broken" in source:
+        return
+    with open(source) as f, open(destination, "w") as out:
+        out.write("baked " + f.read())
+
+if sys.argv[1:] == ["--shell"]:
+    for line in sys.stdin:
+        if line.strip() == "quit":
+            break
+        actions = dict(
+            (action.strip().split(":", 1) + [""])[:2] for action in line.split(";")
+        )
+        bake(actions["file-open"], actions["export-filename"])
+else:
+    bake(sys.argv[1], sys.argv[sys.argv.index("-o") + 1])
+"""
+
+SVGO = """
+import os, sys
+with open(os.environ["MUT_TEST_LOG"], "a") as log:
+    log.write("svgo " + " ".join(sys.argv[1:]) + "\\n")
+
+if sys.argv[1:] == ["--version"]:
+    print(os.environ.get("MUT_TEST_SVGO_VERSION", "3.0.0"))
+    sys.exit(0)
+
+def minify(source, destination):
+    with open(source) as f, open(destination, "w") as out:
+        out.write("minified " + f.read())
+
+destination = sys.argv[sys.argv.index("-o") + 1]
+if "-f" in sys.argv:
+    source = sys.argv[sys.argv.index("-f") + 1]
+    for name in os.listdir(source):
+        minify(os.path.join(source, name), os.path.join(destination, name))
+else:
+    minify(sys.argv[sys.argv.index("-i") + 1], destination)
+"""
+
+
+@pytest.fixture
+def log(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, source in (("inkscape", INKSCAPE), ("svgo", SVGO)):
+        script = bin_dir / name
+        script.write_text("#!{}\n{}".format(sys.executable, source))
+        script.chmod(script.stat().st_mode | stat.S_IEXEC)
+
+    log = tmp_path / "log"
+    log.write_text("")
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("MUT_TEST_LOG", str(log))
+    monkeypatch.setenv(build_images.CACHE_DIR_ENV, str(tmp_path / "cache"))
+    return log
+
+
+def run_main(monkeypatch: pytest.MonkeyPatch, root: Path) -> None:
+    monkeypatch.setattr(sys, "argv", ["mut-images", str(root)])
+    build_images.main()
+
+
+def commands(log: Path) -> List[str]:
+    """The first two words of each logged command line, other than version
+    checks."""
+    return [
+        " ".join(line.split()[:2])
+        for line in log.read_text().splitlines()
+        if not line.endswith("--version")
+    ]
+
+
+def test_batches(
+    tmp_path: Path,
+    log: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    root = tmp_path / "source"
+    (root / "sub").mkdir(parents=True)
+    for name in ("a", "sub/b", "c", "broken", "semi;colon"):
+        (root / (name + ".svg")).write_text(name)
+
+    monkeypatch.setattr(build_images, "MAX_BATCH_SIZE", 3)
+    monkeypatch.setattr(build_images.multiprocessing, "cpu_count", lambda: 1)
+    with caplog.at_level(logging.ERROR):
+        run_main(monkeypatch, root)
+
+    for name in ("a", "sub/b", "c", "semi;colon"):
+        assert (root / (name + ".bakedsvg.svg")).read_text() == "minified baked " + name
+    assert not (root / "broken.bakedsvg.svg").exists()
+    assert [record.getMessage().split(" (")[0] for record in caplog.records] == [
+        "Inkscape failed to export {}".format(root / "broken.svg")
+    ]
+
+    # Two shell sessions and svgo runs bake the four safe paths, and the path
+    # Inkscape's shell can't open is baked alone
+    assert sorted(commands(log)) == [
+        "inkscape --shell",
+        "inkscape --shell",
+        "inkscape {}".format(root / "semi;colon.svg"),
+        "svgo -q",
+        "svgo -q",
+        "svgo -q",
+    ]
+
+    # Up to date images aren't baked again
+    (root / "broken.svg").unlink()
+    log.write_text("")
+    run_main(monkeypatch, root)
+    assert log.read_text() == ""
+
+
+def test_make_batches() -> None:
+    jobs = [(str(i), str(i)) for i in range(120)]
+    assert [len(batch) for batch in build_images.make_batches(jobs, 2)] == [
+        50,
+        50,
+        20,
+    ]
+    assert [len(batch) for batch in build_images.make_batches(jobs, 4)] == [30] * 4
+    assert build_images.make_batches([], 4) == []
+
+
+def test_cache(tmp_path: Path, log: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    root = tmp_path / "source"
+    root.mkdir()
+    for name in ("a", "b"):
+        (root / (name + ".svg")).write_text(name)
+
+    run_main(monkeypatch, root)
+    assert commands(log) == ["inkscape --shell", "svgo -q"]
+    assert len(list((tmp_path / "cache").glob("*/*.svg"))) == 2
+
+    # A fresh clone copies its images from the cache
+    def clone() -> None:
+        for name in ("a", "b"):
+            (root / (name + ".bakedsvg.svg")).unlink()
+            (root / (name + ".svg")).touch()
+        log.write_text("")
+
+    clone()
+    run_main(monkeypatch, root)
+    assert commands(log) == []
+    for name in ("a", "b"):
+        assert (root / (name + ".bakedsvg.svg")).read_text() == "minified baked " + name
+
+    # Changing a source, or a tool's version, misses the cache
+    clone()
+    (root / "a.svg").write_text("changed")
+    run_main(monkeypatch, root)
+    assert commands(log) == ["inkscape --shell", "svgo -q"]
+    assert (root / "a.bakedsvg.svg").read_text() == "minified baked changed"
+
+    clone()
+    monkeypatch.setenv("MUT_TEST_SVGO_VERSION", "4.0.0")
+    run_main(monkeypatch, root)
+    assert len(list((tmp_path / "cache").glob("*/*.svg"))) == 5
+
+    # The cache can be disabled
+    clone()
+    monkeypatch.setattr(sys, "argv", ["mut-images", str(root), "--no-cache"])
+    build_images.main()
+    assert commands(log) == ["inkscape --shell", "svgo -q"]
@@ -0,0 +1,34 @@
+import subprocess
+import sys
+
+import pytest
+
+from mut import helper
+
+
+def test_dispatch(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture
+) -> None:
+    # Subcommands run in this process, with the arguments that follow them
+    monkeypatch.setattr(sys, "argv", ["mut", "index", "--help"])
+    with pytest.raises(SystemExit) as exit_info:
+        helper.main()
+    assert not exit_info.value.code
+    assert "mut-index <root>" in capsys.readouterr().out
+
+
+def test_lazy_imports() -> None:
+    # Heavy dependencies must not be loaded just to start a command
+    modules = ", ".join(helper.COMMANDS.values())
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "import sys, {}; print(sorted(set(sys.modules) & {{{}}}))".format(
+                modules,
+                "'boto3', 'botocore', 'bson', 'jsonpath_ng', 'requests', 'yaml'",
+            ),
+        ],
+        universal_newlines=True,
+    )
+    assert output.strip() == "[]"
@@ -0,0 +1,190 @@
+import http.server
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import pytest
+
+from mut import intersphinx
+from mut.intersphinx import Inventory, read_metadata, update, update_all
+from mut.inventory import InventoryIndex, index_path
+from mut.test_inventory import make_inventory
+
+DELAY = 0.3
+
+
+class InventoryHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The client port of every request served, to tell connections apart
+    requests: List[Tuple[str, int]] = []
+    # The If-None-Match and If-Modified-Since headers of every request
+    conditions: List[Tuple[Optional[str], Optional[str]]] = []
+    etag = '"1"'
+
+    def do_GET(self) -> None:
+        self.requests.append((self.path, self.client_address[1]))
+        self.conditions.append(
+            (self.headers["If-None-Match"], self.headers["If-Modified-Since"])
+        )
+        if self.path.startswith("/slow/"):
+            time.sleep(DELAY)
+
+        if self.path.startswith("/missing/"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.headers["If-None-Match"] == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = self.path.encode("utf-8")
+        if self.path.startswith("/inventory/"):
+            body = make_inventory("Project", "page std:doc -1 page/ Page\n")
+
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Last-Modified", "Mon, 05 Oct 2026 12:00:00 GMT")
+        if self.path.startswith("/truncated/"):
+            # Promise more than is sent, then hang up
+            self.send_header("Content-Length", str(len(body) + 100))
+            self.end_headers()
+            self.wfile.write(body)
+            self.close_connection = True
+            return
+
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def server() -> Iterator[str]:
+    InventoryHandler.requests = []
+    InventoryHandler.conditions = []
+    InventoryHandler.etag = '"1"'
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), InventoryHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_update_all(
+    server: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "build").mkdir()
+
+    inventories = [
+        Inventory("slow{}".format(i), "{}/slow/{}/objects.inv".format(server, i))
+        for i in range(4)
+    ]
+    inventories.append(Inventory("missing", server + "/missing/objects.inv"))
+
+    # Downloads overlap
+    start = time.perf_counter()
+    results = update_all(inventories, timeout=5, n_workers=4)
+    assert time.perf_counter() - start < DELAY * 3
+    assert [result.outcome for result in results] == ["downloaded"] * 4 + ["error"]
+    assert all(result.seconds >= DELAY for result in results[:4])
+    for inventory in inventories[:4]:
+        path = tmp_path / "build" / intersphinx.resolve_path(*inventory)
+        assert path.read_bytes() == inventory.url[len(server) :].encode("utf-8")
+
+    # Inventories are fresh for a day
+    results = update_all(inventories[:4], timeout=5, n_workers=4)
+    assert [result.outcome for result in results] == ["fresh"] * 4
+
+    # Each worker keeps its connection alive between downloads
+    InventoryHandler.requests = []
+    update_all([inventories[-1]] * 3, timeout=5, n_workers=1)
+    assert len({port for _, port in InventoryHandler.requests}) == 1
+
+
+def test_timeout(server: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "build").mkdir()
+    results = update_all(
+        [Inventory("slow", server + "/slow/objects.inv")], timeout=0.05, n_workers=1
+    )
+    assert results[0].outcome == "error"
+    assert list((tmp_path / "build").iterdir()) == []
+
+
+def test_revalidate(
+    server: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "build").mkdir()
+    url = server + "/manual/objects.inv"
+    path = str(tmp_path / "build" / intersphinx.resolve_path("manual", url))
+
+    # Nothing is cached, so the request is unconditional
+    assert update("manual", url, timeout=5) == "downloaded"
+    assert InventoryHandler.conditions.pop() == (None, None)
+    metadata = read_metadata(path)
+    assert (metadata["etag"], metadata["last_modified"]) == (
+        '"1"',
+        "Mon, 05 Oct 2026 12:00:00 GMT",
+    )
+
+    assert update("manual", url, timeout=5) == "fresh"
+    assert not InventoryHandler.conditions
+
+    # Revalidating renews the inventory without downloading it again
+    assert update("manual", url, timeout=5, max_age=0) == "not modified"
+    assert InventoryHandler.conditions.pop() == (
+        '"1"',
+        "Mon, 05 Oct 2026 12:00:00 GMT",
+    )
+    assert read_metadata(path)["fetched"] > metadata["fetched"]
+    assert read_metadata(path)["etag"] == '"1"'
+    assert update("manual", url, timeout=5) == "fresh"
+
+    InventoryHandler.etag = '"2"'
+    assert update("manual", url, timeout=5, max_age=0) == "downloaded"
+    assert read_metadata(path)["etag"] == '"2"'
+
+
+def test_interrupted(
+    server: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    build = tmp_path / "build"
+    build.mkdir()
+    url = server + "/truncated/objects.inv"
+    (build / intersphinx.resolve_path("truncated", url)).write_bytes(b"old")
+
+    # The cached inventory is only replaced by a complete download
+    assert update("truncated", url, timeout=5, max_age=0) == "error"
+    assert [path.name for path in build.iterdir()] == [
+        intersphinx.resolve_path("truncated", url)
+    ]
+    assert (build / intersphinx.resolve_path("truncated", url)).read_bytes() == b"old"
+
+
+def test_index(server: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "build").mkdir()
+    inventory = Inventory("project", server + "/inventory/objects.inv")
+    path = str(tmp_path / "build" / intersphinx.resolve_path(*inventory))
+
+    update_all([inventory], timeout=5, n_workers=1, index=True)
+    index = InventoryIndex(path)
+    entry = index.get("std:doc", "page")
+    index.close()
+    assert entry is not None and entry.url == server + "/inventory/page/"
+
+    # An index is only rebuilt when its inventory changes
+    mtime = os.stat(index_path(path)).st_mtime_ns
+    update_all([inventory], timeout=5, n_workers=1, max_age=0, index=True)
+    assert os.stat(index_path(path)).st_mtime_ns == mtime
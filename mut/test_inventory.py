@@ -0,0 +1,84 @@
+import zlib
+from pathlib import Path
+
+import pytest
+
+from mut.inventory import (
+    InventoryEntry,
+    InventoryIndex,
+    is_index_current,
+    lookup,
+    write_index,
+)
+
+
+def make_inventory(project: str, lines: str) -> bytes:
+    header = (
+        "# Sphinx inventory version 2\n"
+        "# Project: {}\n"
+        "# Version: 1.0\n"
+        "# The remainder of this file is compressed using zlib.\n".format(project)
+    )
+    return header.encode("utf-8") + zlib.compress(lines.encode("utf-8"))
+
+
+def test_index(tmp_path: Path) -> None:
+    python = tmp_path / "python.inv"
+    python.write_bytes(
+        make_inventory(
+            "Python",
+            "os.path.join py:function 1 library/os.path.html#$ -\n"
+            "os.path.join py:function 1 library/duplicate.html#$ -\n"
+            "tutorial std:label -1 tutorial/index.html#tutorial The Tutorial\n"
+            "Main Page std:doc -1 index.html -\n",
+        )
+    )
+    manual = tmp_path / "manual.inv"
+    manual.write_bytes(
+        make_inventory(
+            "MongoDB",
+            "tutorial std:label -1 tutorial/ Tutorials\n"
+            "db.find js:method 1 reference/method/$ -\n",
+        )
+    )
+
+    assert not is_index_current(str(python))
+    assert write_index(str(python), "https://docs.python.org/3/") == 3
+    assert write_index(str(manual), "https://www.mongodb.com/docs/manual/") == 2
+    assert is_index_current(str(python))
+
+    indexes = [InventoryIndex(str(python)), InventoryIndex(str(manual))]
+    assert (indexes[0].project, indexes[0].version) == ("Python", "1.0")
+    assert lookup(indexes, "py:function", "os.path.join") == InventoryEntry(
+        "os.path.join",
+        "py:function",
+        1,
+        "https://docs.python.org/3/library/os.path.html#os.path.join",
+        "os.path.join",
+    )
+    assert lookup(indexes, "std:doc", "Main Page") == InventoryEntry(
+        "Main Page", "std:doc", -1, "https://docs.python.org/3/index.html", "Main Page"
+    )
+    assert lookup(indexes, "js:method", "db.find") == InventoryEntry(
+        "db.find",
+        "js:method",
+        1,
+        "https://www.mongodb.com/docs/manual/reference/method/db.find",
+        "db.find",
+    )
+
+    # Earlier inventories take precedence
+    entry = lookup(indexes, "std:label", "tutorial")
+    assert entry is not None and entry.dispname == "The Tutorial"
+    assert lookup(indexes, "py:class", "os.path.join") is None
+
+    for index in indexes:
+        index.close()
+
+
+def test_bad_inventory(tmp_path: Path) -> None:
+    path = tmp_path / "bad.inv"
+    path.write_bytes(b"# Sphinx inventory version 1\n")
+    with pytest.raises(ValueError):
+        write_index(str(path), "https://example.com/")
+    assert [child.name for child in tmp_path.iterdir()] == ["bad.inv"]
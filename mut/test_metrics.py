@@ -0,0 +1,38 @@
+import json
+import pstats
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from mut import metrics
+
+
+def test_instrument(tmp_path: Path) -> None:
+    metrics_file = tmp_path / "metrics.json"
+    with metrics.instrument("mut-test", str(metrics_file)):
+        with metrics.span("phase"):
+            with ThreadPoolExecutor(4) as pool:
+                list(pool.map(lambda n: metrics.count("bytes", n), range(100)))
+        with metrics.span("phase"):
+            metrics.count("requests")
+
+    report = json.loads(metrics_file.read_text())
+    assert report["tool"] == "mut-test"
+    assert report["spans"]["phase"]["count"] == 2
+    assert report["seconds"] >= report["spans"]["phase"]["seconds"]
+    assert report["counters"] == {"bytes": sum(range(100)), "requests": 1}
+
+
+def test_instrument_exit(tmp_path: Path) -> None:
+    # Reports are written even when the tool exits with an error
+    metrics_file = tmp_path / "metrics.json"
+    profile = tmp_path / "profile.pstats"
+    with pytest.raises(SystemExit):
+        with metrics.instrument("mut-test", str(metrics_file), str(profile)):
+            metrics.count("errors")
+            sys.exit(1)
+
+    assert json.loads(metrics_file.read_text())["counters"] == {"errors": 1}
+    assert pstats.Stats(str(profile)).get_stats_profile().func_profiles
@@ -11,10 +11,16 @@ from typing import (
     Union,
     Iterable,
     NamedTuple,
+    Tuple,
 )
 
 _T = TypeVar("_T")
 VT100 = {"red": "31", "green": "32", "yellow": "33", "bright": "1"}
+# Redirect sources with these extensions are files. Any other source is a page,
+# served from an index file beneath it.
+REDIRECT_FILE_EXTENSIONS = (".gz", ".pdf", ".epub", ".html")
+# The first line of a table of redirects written by mut-redirects --format=table
+REDIRECT_TABLE_HEADER = "key\tpage\tstatus\ttarget\tsource\n"
 
 
 def compare_mtimes(target: str, dependencies: List[str]) -> bool:
@@ -63,6 +69,15 @@ def list_str_any_dict(values: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return [str_any_dict(x) for x in values]
 
 
+def split_redirect_key(source: str) -> Tuple[str, bool]:
+    """Return the S3 key for a redirect's source path, and whether it is a page
+    whose key needs the bucket's index suffix appended."""
+    if os.path.splitext(source)[1] in REDIRECT_FILE_EXTENSIONS:
+        return source.lstrip("/"), False
+
+    return source.strip("/"), True
+
+
 def color(message: str, options: Iterable[str]) -> str:
     composite = []
     for option in options: